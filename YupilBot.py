@@ -1,36 +1,362 @@
+import time
+startup_started = time.monotonic()  # for reporting time to first readiness
 import sys
 import discord
 from discord import app_commands as ac
 from discord.ext import commands
-import deepl
 import configparser
 import os
 from dotenv import load_dotenv
 import datetime
-import chat_exporter
 import io
+import asyncio
+import re
+import sqlite3
+import collections
+import unicodedata
+import concurrent.futures
+import functools
+import json
+import hashlib
+import aiohttp
+import gzip
+import html
+import zoneinfo
+import html.parser
+import signal
+import logging
+import math
+import aiohttp.web
+import threading
+import csv
+import tempfile
+import traceback
 
 # Set environment and read config file
 if os.getenv('YUPIL_ENV') != "prod":
     load_dotenv(".env.local")
 else:
     load_dotenv(".env")
-config = configparser.ConfigParser()
-config.read('config.ini')
 
-server_id = os.getenv('DISCORD_SERVER_ID')  # Server ID
-permitted_role = config[os.getenv('YUPIL_ENV')]['permitted_role']  # Only users with this role can use the commands
+# Typed, validated settings: process-wide from [<env>], per guild from [<env>] overridden by [<env>:<guild ID>]
+class Settings:
+    """Settings from one config.ini section, validated at load, with channel and role handles resolved from the guild cache"""
+    def __init__(self, section_name: str, path: str = "config.ini", guild_id: int = None):
+        parser = configparser.ConfigParser()
+        if len(parser.read(path)) == 0 or not parser.has_section(section_name):
+            raise ValueError(f"Config section [{section_name}] not found in {path}")
+        self.section_name = section_name
+        self.path = path
+        self.guild_id = guild_id
+        self.label = section_name if guild_id == None else f"{section_name}:{guild_id}"
+        if guild_id != None and parser.has_section(self.label):
+            parser[self.label] = {**parser[section_name], **parser[self.label]}
+            self.section = parser[self.label]
+        else:
+            self.section = parser[section_name]
+        self.errors = []
+
+        if guild_id != None:
+            # Per-guild settings
+            self.log_channel_id = self._snowflake('log_channel')
+            self.welcome_channel_id = self._snowflake('welcome_channel')
+            self.helpdesk_channel_id = self._snowflake('helpdesk_channel')
+            self.transcript_channel_id = self._snowflake('transcript_channel')
+            self.permitted_role = self._text('permitted_role')  # Only users with this role can use the commands
+            self.cache_size = self._int('cache_size', 20000)
+            self.restrict_mode = self._choice('restrict_mode', ("overwrites", "role"))
+            self.restricted_role = self._text('restricted_role', 'Restricted')
+            self.log_queue_size = self._int('log_queue_size', 1000)
+            self.log_flush_interval = self._float('log_flush_interval', 2)
+            self.log_webhook_url = self.section.get('log_webhook_url', '').strip() or None
+            self.transcript_style = self._choice('transcript_style', ("stream", "rich"))
+            self.welcome_window_seconds = self._float('welcome_window_seconds', 600)
+            self.welcome_window_size = self._int('welcome_window_size', 1000)
+            self.ticket_cooldown_seconds = self._float('ticket_cooldown_seconds', 60)
+            self.auto_translate_channels = self._snowflakes('auto_translate_channels')
+            self.auto_translate_min_letters = self._int('auto_translate_min_letters', 12)
+            self.raid_join_threshold = self._int('raid_join_threshold', 10, minimum = 0)  # 0 turns join flood detection off
+            self.raid_window_seconds = self._float('raid_window_seconds', 10)
+            self.raid_account_age_days = self._float('raid_account_age_days', 7)
+            self.raid_min_signals = self._int('raid_min_signals', 1, minimum = 0)
+            self.raid_action = self._choice('raid_action', ("alert", "quarantine"))  # alert by default; quarantine is opt-in
+        else:
+            # Process-wide settings, shared by every guild
+            self.guild_ids = self._snowflakes('guilds')
+            self.overwrite_concurrency = self._int('overwrite_concurrency', 5)
+            self.overwrite_retries = self._int('overwrite_retries', 3, minimum = 0)
+            self.translation_db = self._text('translation_db', 'translations.db')
+            self.translation_cache_size = self._int('translation_cache_size', 1000)
+            self.translation_store_size = self._int('translation_store_size', 100000)
+            self.deepl_char_limit = self._int('deepl_char_limit', 500000)
+            self.deepl_warn_ratio = self._float('deepl_warn_ratio', 0.9)
+            self.translation_workers = self._int('translation_workers', 2)
+            self.translation_batch_window_ms = self._int('translation_batch_window_ms', 50, minimum = 0)
+            self.translation_timeout = self._float('translation_timeout', 10)
+            self.message_store_db = self._text('message_store_db', 'messages.db')
+            self.message_store_memory_mb = self._int('message_store_memory_mb', 16)
+            self.message_store_retention_days = self._int('message_store_retention_days', 30)
+            self.message_store_max_rows = self._int('message_store_max_rows', 1000000)
+            self.attachment_capture = self._bool('attachment_capture', False)
+            self.attachment_dir = self._text('attachment_dir', 'attachments')
+            self.attachment_max_mb = self._int('attachment_max_mb', 25)
+            self.attachment_budget_mb = self._int('attachment_budget_mb', 2048)
+            self.attachment_max_age_days = self._int('attachment_max_age_days', 30)
+            self.transcript_index_db = self._text('transcript_index_db', 'transcripts/index.db')
+            self.ticket_db = self._text('ticket_db', 'tickets.db')
+            self.history_db = self._text('history_db', 'history.db')
+            self.broadcast_db = self._text('broadcast_db', 'broadcasts.db')
+            self.dm_concurrency = self._int('dm_concurrency', 2)
+            self.dm_interval = self._float('dm_interval', 0.5)
+            self.overwrite_snapshot_db = self._text('overwrite_snapshot_db', 'overwrites.db')
+            self.job_db = self._text('job_db', 'jobs.db')
+            self.job_workers = self._int('job_workers', 2)
+            self.job_retries = self._int('job_retries', 3, minimum = 0)
+            self.job_shutdown_timeout = self._float('job_shutdown_timeout', 30)
+            self.metrics_host = self._text('metrics_host', '127.0.0.1')
+            self.metrics_port = self._int('metrics_port', 0, minimum = 0)
+        if len(self.errors) > 0:
+            raise ValueError(f"Invalid config section [{self.label}]:\n  " + "\n  ".join(self.errors))
+
+        # Handles resolved from the guild cache by resolve()
+        self.log_channel = None
+        self.welcome_channel = None
+        self.helpdesk_channel = None
+        self.transcript_channel = None
+        self.mod_role = None
+        self.quarantine_role = None  # created on startup in role mode, so not reported when missing
+
+    def _snowflake(self, key: str):
+        value = self.section.get(key, '').strip()
+        if not value.isdigit() or int(value) == 0:
+            self.errors.append(f"{key} must be a channel ID, got '{value}'")
+            return 0
+        return int(value)
+
+    def _snowflakes(self, key: str):
+        values = self.section.get(key, '').replace(',', ' ').split()
+        for value in values:
+            if not value.isdigit() or int(value) == 0:
+                self.errors.append(f"{key} must be a list of IDs, got '{value}'")
+        return [int(value) for value in values if value.isdigit()]
+
+    def _text(self, key: str, default: str = None):
+        value = self.section.get(key, '').strip() or default
+        if value == None:
+            self.errors.append(f"{key} must not be empty")
+        return value
+
+    def _int(self, key: str, default: int, minimum: int = 1):
+        try:
+            value = int(self.section.get(key, str(default)))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            self.errors.append(f"{key} must be a whole number of at least {minimum}, got '{self.section.get(key)}'")
+        return value
+
+    def _float(self, key: str, default: float):
+        try:
+            value = float(self.section.get(key, str(default)))
+        except ValueError:
+            value = -1
+        if value < 0:
+            self.errors.append(f"{key} must be a non-negative number, got '{self.section.get(key)}'")
+        return value
+
+    def _bool(self, key: str, default: bool):
+        try:
+            return self.section.getboolean(key, fallback = default)
+        except ValueError:
+            self.errors.append(f"{key} must be true or false, got '{self.section.get(key)}'")
+            return default
+
+    def _choice(self, key: str, choices: tuple):
+        value = self.section.get(key, choices[0]).strip()
+        if value not in choices:
+            self.errors.append(f"{key} must be one of {', '.join(choices)}, got '{value}'")
+        return value
+
+    def resolve(self, guild: discord.Guild):
+        """Resolves channel and role handles from the guild cache; call again whenever the guild changes"""
+        self.log_channel = guild.get_channel(self.log_channel_id)
+        self.welcome_channel = guild.get_channel(self.welcome_channel_id)
+        self.helpdesk_channel = guild.get_channel(self.helpdesk_channel_id)
+        self.transcript_channel = guild.get_channel(self.transcript_channel_id)
+        self.mod_role = discord.utils.get(guild.roles, name = self.permitted_role)
+        self.quarantine_role = discord.utils.get(guild.roles, name = self.restricted_role)
+        for name in ("log_channel", "welcome_channel", "helpdesk_channel", "transcript_channel", "mod_role"):
+            if getattr(self, name) == None:
+                print(f"Config [{self.label}]: {name} not found in {guild.name}")
 
-# Set bot intents and bot configuration
+    def reload(self, guild: discord.Guild = None):
+        """Re-reads config.ini, keeping the current settings if the new ones are invalid"""
+        try:
+            fresh = Settings(self.section_name, self.path, self.guild_id)
+        except ValueError as e:
+            print(f"Config reload failed, keeping previous settings. {e}")
+            return False
+        self.__dict__.update(fresh.__dict__)
+        if guild != None:
+            self.resolve(guild)
+        print(f"Reloaded config section [{self.label}]")
+        return True
+
+settings = Settings(os.getenv('YUPIL_ENV'))
+# Guilds served by this process: the guilds list, or DISCORD_SERVER_ID for a single-guild deployment
+guild_ids = settings.guild_ids or [int(os.getenv('DISCORD_SERVER_ID'))]
+guild_settings = {guild_id: Settings(os.getenv('YUPIL_ENV'), guild_id = guild_id) for guild_id in guild_ids}
+guild_objects = [discord.Object(id = guild_id) for guild_id in guild_ids]
+
+# Set bot intents and bot configuration; shards are assigned by Discord based on the number of guilds
 intents = discord.Intents.default() 
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix = '/', intents = intents, max_messages = int(config[os.getenv('YUPIL_ENV')]['cache_size']))
+message_cache_size = sum(config.cache_size for config in guild_settings.values())
+bot = commands.AutoShardedBot(command_prefix = '/', intents = intents, max_messages = message_cache_size)
 tree = bot.tree
 
-# Set channels
-welcome_channel = int(config[os.getenv('YUPIL_ENV')]['welcome_channel'])
-helpdesk_channel = int(config[os.getenv('YUPIL_ENV')]['helpdesk_channel'])
+# Metrics registry, served in Prometheus text format when metrics_port is set
+class Metrics:
+    """Minimal Prometheus registry of labelled counters, histograms and callback gauges"""
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self.gauges = {}  # name -> callable returning a number or {labels: number}
+        self.help = {}
+
+    @staticmethod
+    def _labels(labels: dict):
+        return tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: dict = None, value: float = 1, help: str = ""):
+        key = (name, self._labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+        self.help.setdefault(name, help)
+
+    def observe(self, name: str, seconds: float, labels: dict = None, help: str = ""):
+        key = (name, self._labels(labels))
+        histogram = self.histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[0][i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+        self.help.setdefault(name, help)
+
+    def gauge(self, name: str, function, help: str = ""):
+        self.gauges[name] = function
+        self.help[name] = help
+
+    @staticmethod
+    def _format(labels: tuple, extra: tuple = ()):
+        pairs = labels + extra
+        if len(pairs) == 0:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format"""
+        lines = []
+        for name in sorted({name for name, labels in self.counters}):
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} counter"]
+            lines += [f"{name}{self._format(labels)} {value}" for (n, labels), value in self.counters.items() if n == name]
+        for name in sorted({name for name, labels in self.histograms}):
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} histogram"]
+            for (n, labels), (counts, total, count) in self.histograms.items():
+                if n != name:
+                    continue
+                lines += [f"{name}_bucket{self._format(labels, (('le', bound),))} {counts[i]}" for i, bound in enumerate(self.buckets)]
+                lines += [f"{name}_bucket{self._format(labels, (('le', '+Inf'),))} {count}",
+                          f"{name}_sum{self._format(labels)} {total}", f"{name}_count{self._format(labels)} {count}"]
+        for name, function in sorted(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} gauge"]
+            values = value if isinstance(value, dict) else {(): value}
+            lines += [f"{name}{self._format(labels)} {v}" for labels, v in values.items() if not math.isnan(v)]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def timed(handler):
+    """Records the run time of an event handler"""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            metrics.observe("yupil_event_seconds", time.perf_counter() - started, {"event": handler.__name__}, "Event handler run time")
+    return wrapper
+
+# Count REST calls by method and route template
+original_request = bot.http.request
+
+async def counted_request(route, **kwargs):
+    labels = {"method": route.method, "route": route.path}
+    metrics.inc("yupil_rest_requests_total", labels, help = "REST calls made by route")
+    try:
+        return await original_request(route, **kwargs)
+    except discord.HTTPException as e:
+        metrics.inc("yupil_rest_errors_total", {**labels, "status": e.status}, help = "REST calls that failed by route and status")
+        raise
+
+bot.http.request = counted_request
+
+class RateLimitCounter(logging.Handler):
+    """Counts the 429 responses discord.py retries internally, which it only reports through its log"""
+    def emit(self, record: logging.LogRecord):
+        if str(record.msg).startswith("We are being rate limited.") and len(record.args or ()) >= 2:
+            path = re.sub(r"\d{15,20}", "{id}", str(record.args[1]).split("/api/v10", 1)[-1])
+            metrics.inc("yupil_rest_rate_limited_total", {"method": record.args[0], "route": path}, help = "429 responses by route")
+        elif str(record.msg).startswith("Global rate limit"):
+            metrics.inc("yupil_rest_rate_limited_total", {"method": "*", "route": "global"}, help = "429 responses by route")
+
+logging.getLogger("discord.http").addHandler(RateLimitCounter(level = logging.WARNING))
+
+async def start_metrics_server():
+    """Serves /metrics on the configured local port"""
+    async def serve(request):
+        return aiohttp.web.Response(text = metrics.render(), content_type = "text/plain", charset = "utf-8")
+    app = aiohttp.web.Application()
+    app.router.add_get("/metrics", serve)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, settings.metrics_host, settings.metrics_port).start()
+    print(f"Serving metrics on http://{settings.metrics_host}:{settings.metrics_port}/metrics")
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    metrics.observe("yupil_command_seconds", (discord.utils.utcnow() - interaction.created_at).total_seconds(),
+                    {"command": command.name, "outcome": "ok"}, "Slash command latency from invocation to completion")
+
+@tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: ac.AppCommandError):
+    name = interaction.command.name if interaction.command != None else "unknown"
+    metrics.observe("yupil_command_seconds", (discord.utils.utcnow() - interaction.created_at).total_seconds(),
+                    {"command": name, "outcome": "error"}, "Slash command latency from invocation to completion")
+    if isinstance(error, ac.CheckFailure) and not interaction.response.is_done():
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral = True)
+    else:
+        # Fall back to discord.py's default handler, which logs the full traceback
+        await ac.CommandTree.on_error(tree, interaction, error)
+
+def is_mod():
+    """App command check: the user must have the mod role configured for the guild (re-read on config reload)"""
+    def predicate(interaction: discord.Interaction):
+        config = guild_settings.get(interaction.guild_id)
+        if config == None:
+            raise ac.NoPrivateMessage()
+        if config.mod_role == None or not isinstance(interaction.user, discord.Member) or config.mod_role not in interaction.user.roles:
+            raise ac.MissingRole(config.permitted_role)
+        return True
+    return ac.check(predicate)
 
 # Set embed colors
 yupil_color = discord.Color.from_rgb(0, 255, 255)
@@ -38,21 +364,326 @@ member_color = discord.Color.from_rgb(252, 192, 246)
 deletion_color = discord.Color.from_rgb(255, 71, 15)
 edit_color = discord.Color.from_rgb(51, 127, 213)
 
-# DeepL authentication
+# DeepL authentication, deferred until the first translation so startup does not pay for it
 auth_key = os.getenv('DEEPL_API_TOKEN')
+translator = None
+translator_lock = threading.Lock()
+
+def get_translator():
+    """Imports deepl and creates the translator on first use"""
+    global translator
+    with translator_lock:
+        if translator == None:
+            import deepl
+            try:
+                translator = deepl.Translator(auth_key)
+            except:
+                print("Invalid DeepL key - check current key or generate a new one.")
+                raise
+        return translator
+
+# Translation cache and DeepL character quota accounting
+class TranslationCache:
+    """In-memory LRU of translations backed by a SQLite store, with a monthly DeepL character ledger"""
+    def __init__(self, path: str, memory_size: int, disk_size: int):
+        self.memory = collections.OrderedDict()
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS translations (source TEXT, target_lang TEXT, result TEXT, last_used REAL, PRIMARY KEY (source, target_lang))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS usage (month TEXT PRIMARY KEY, characters INTEGER)")
+        self.db.commit()
+
+    @staticmethod
+    def normalize(text: str):
+        """Normalizes source text so trivially different inputs share a cache entry"""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def get(self, text: str, target_lang: str):
+        """Returns a cached translation or None, promoting disk hits into memory"""
+        key = (self.normalize(text), target_lang)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        row = self.db.execute("SELECT result FROM translations WHERE source = ? AND target_lang = ?", key).fetchone()
+        if row == None:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE translations SET last_used = ? WHERE source = ? AND target_lang = ?", (time.time(), *key))
+        self.db.commit()
+        self.hits += 1
+        self._remember(key, row[0])
+        return row[0]
+
+    def put(self, text: str, target_lang: str, result: str):
+        """Stores a translation in memory and on disk, evicting the least recently used disk entries over budget"""
+        key = (self.normalize(text), target_lang)
+        self._remember(key, result)
+        self.db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", (*key, result, time.time()))
+        overflow = self.db.execute("SELECT COUNT(*) FROM translations").fetchone()[0] - self.disk_size
+        if overflow > 0:
+            self.db.execute("DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY last_used LIMIT ?)", (overflow,))
+        self.db.commit()
+
+    def _remember(self, key: tuple, result: str):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last = False)
+
+    def stored(self):
+        """Returns the number of translations stored on disk"""
+        return self.db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
 
-try:
-    translator = deepl.Translator(auth_key)
-except:
-    print("Invalid DeepL key - check current key or generate a new one.")
+    def used(self):
+        """Returns the number of DeepL characters used in the current billing month"""
+        row = self.db.execute("SELECT characters FROM usage WHERE month = ?", (datetime.date.today().strftime("%Y-%m"),)).fetchone()
+        return 0 if row == None else row[0]
+
+    def charge(self, characters: int):
+        """Records DeepL characters used in the current billing month"""
+        self.db.execute("INSERT INTO usage VALUES (?, ?) ON CONFLICT (month) DO UPDATE SET characters = characters + excluded.characters",
+                        (datetime.date.today().strftime("%Y-%m"), characters))
+        self.db.commit()
+
+# Non-blocking DeepL translation engine
+class TranslationEngine:
+    """Runs DeepL translations on a worker pool, coalescing requests that arrive within a short window into one call"""
+    max_batch = 50  # DeepL accepts up to 50 texts per request
+
+    def __init__(self, workers: int, window: float, timeout: float):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "deepl")
+        self.window = window
+        self.timeout = timeout
+        self.pending = {}  # target language -> list of (text, future)
+        self.flushes = {}  # target language -> scheduled flush task
+
+    def queue_depth(self):
+        """Returns the number of texts waiting to be sent to DeepL"""
+        return sum(len(batch) for batch in self.pending.values())
+
+    async def translate(self, text: str, target_lang: str):
+        """Translates text without blocking the event loop, raises asyncio.TimeoutError after the configured timeout"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(target_lang, []).append((text, future))
+        if target_lang not in self.flushes:
+            self.flushes[target_lang] = asyncio.create_task(self._flush(target_lang))
+        # Shield the shared batch so one caller timing out does not cancel it for the others
+        return await asyncio.wait_for(asyncio.shield(future), timeout = self.timeout)
+
+    async def _flush(self, target_lang: str):
+        await asyncio.sleep(self.window)
+        batch = self.pending.pop(target_lang, [])
+        del self.flushes[target_lang]
+        for i in range(0, len(batch), self.max_batch):
+            asyncio.create_task(self._send(batch[i:i + self.max_batch], target_lang))
+
+    async def _send(self, batch: list, target_lang: str):
+        texts = list(dict.fromkeys(text for text, future in batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: get_translator().translate_text(texts, target_lang = target_lang))
+            translation_cache.charge(sum(len(text) for text in texts))
+            translated = {text: str(result) for text, result in zip(texts, results)}
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(translated[text])
+        except Exception as e:
+            for text, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+translation_engine = TranslationEngine(workers = settings.translation_workers,
+                                       window = settings.translation_batch_window_ms / 1000,
+                                       timeout = settings.translation_timeout)
+
+translation_cache = TranslationCache(path = settings.translation_db,
+                                     memory_size = settings.translation_cache_size,
+                                     disk_size = settings.translation_store_size)
+
+# Batched, coalescing log sink for the moderation log channel
+class LogSink:
+    """Bounded queue of log entries delivered in order, packing up to 10 embeds per message and flushing on size or time"""
+    max_embeds = 10
+    max_embed_chars = 6000
+    max_files = 10
+    max_content = 2000
+
+    def __init__(self, guild_id: int, queue_size: int, flush_interval: float, webhook_url: str = None):
+        self.guild_id = guild_id
+        self.queue = asyncio.Queue(maxsize = queue_size)
+        self.flush_interval = flush_interval
+        self.webhook_url = webhook_url
+        self.webhook = None
+        self.task = None
+        self.carry = None  # entry that did not fit in the previous batch
+        self.flushing = False  # set on shutdown so queued entries go out without waiting for the flush interval
+
+    def start(self):
+        """Starts the delivery task; safe to call on every reconnect"""
+        if self.task == None:
+            if self.webhook_url:
+                # Deliver through a webhook so logging does not share the bot's rate-limit buckets
+                self.webhook = discord.Webhook.from_url(self.webhook_url, client = bot)
+            self.task = asyncio.create_task(self._run())
+
+    async def flush(self, timeout: float):
+        """Delivers every queued entry without waiting for the flush interval and returns once they have been sent"""
+        if self.task == None:
+            return
+        self.flushing = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout = timeout)
+        except asyncio.TimeoutError:
+            print(f"Gave up on {self.queue.qsize()} undelivered log entries for guild {self.guild_id}")
+        finally:
+            self.flushing = False
+
+    async def send(self, content: str = None, embed: discord.Embed = None, files: list = None, wait: bool = False):
+        """Queues a log entry; with wait=True, returns the log message once it has been delivered"""
+        future = asyncio.get_running_loop().create_future() if wait else None
+        if embed != None:
+            clamp_embed(embed)
+        await self.queue.put((content[:self.max_content] if content != None else None, embed, files or [], future))
+        if future != None:
+            return await future
+
+    def _fits(self, batch: list, entry: tuple):
+        content, embed, files, future = entry
+        embeds = [e for c, e, f, fut in batch if e != None] + ([embed] if embed != None else [])
+        contents = [c for c, e, f, fut in batch if c != None] + ([content] if content != None else [])
+        return (len(embeds) <= self.max_embeds
+                and sum(len(e) for e in embeds) <= self.max_embed_chars
+                and sum(len(f) for c, e, f, fut in batch) + len(files) <= self.max_files
+                and len("\n".join(contents)) <= self.max_content)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [self.carry if self.carry != None else await self.queue.get()]
+            self.carry = None
+            try:
+                deadline = loop.time() + (0 if self.flushing else self.flush_interval)
+                while True:
+                    try:
+                        # Entries already queued are taken directly: a zero timeout gives up before get() can return
+                        entry = self.queue.get_nowait() if not self.queue.empty() else await asyncio.wait_for(self.queue.get(), timeout = max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        break
+                    if not self._fits(batch, entry):
+                        self.carry = entry
+                        break
+                    batch.append(entry)
+                await self._deliver(batch)
+            except Exception as e:
+                # Never let one bad batch stop delivery: a dead task would leave every later send() waiting on a full queue
+                print(f"Failed to deliver {len(batch)} log entries: {e}")
+                self._settle(batch, e)
+            finally:
+                for entry in batch:
+                    self.queue.task_done()
+
+    def _settle(self, batch: list, result):
+        """Resolves the futures of a batch's entries with the log message or the delivery error"""
+        for c, e, f, future in batch:
+            if future != None and not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _deliver(self, batch: list):
+        message = await self._post(batch)
+        if isinstance(message, discord.HTTPException) and message.status < 500 and message.status != 429 and len(batch) > 1:
+            # Discord rejected the whole batch for one bad entry; send them one at a time so only that entry is dropped
+            for entry in batch:
+                await self._deliver([entry])
+            return
+        if isinstance(message, Exception):
+            print(f"Failed to deliver {len(batch)} log entries: {message}")
+        self._settle(batch, message)
+
+    async def _post(self, batch: list):
+        """Sends a batch as one message, retrying rate limits and server errors; returns the message or the last error"""
+        contents = [c for c, e, f, fut in batch if c != None]
+        kwargs = {"content": "\n".join(contents) if len(contents) > 0 else None,
+                  "embeds": [e for c, e, f, fut in batch if e != None]}
+        files = [file for c, e, f, fut in batch for file in f]
+        for attempt in range(3):
+            # Files may already have been read by an earlier attempt or by the rejected batch this entry was split from,
+            # and discord.py closes files it opened from a path after each request
+            files = [reopen_file(file) for file in files]
+            try:
+                if self.webhook != None:
+                    return await self.webhook.send(wait = True, username = bot.user.display_name,
+                                                   avatar_url = bot.user.display_avatar.url, files = files, **kwargs)
+                return await guild_settings[self.guild_id].log_channel.send(files = files, **kwargs)
+            except Exception as e:
+                message = e
+                if isinstance(e, discord.HTTPException) and e.status < 500 and e.status != 429:
+                    break
+                await asyncio.sleep(2 ** attempt)
+        return message
+
+def reopen_file(file: discord.File):
+    """Returns a file ready to upload again: rewound to its start, or reopened if discord.py opened (and closed) it from a path"""
+    if file._owner and file.fp.closed:
+        return discord.File(file.fp.name, filename = file.filename, spoiler = file.spoiler, description = file.description)
+    file.reset()
+    return file
+
+def clamp_embed(embed: discord.Embed):
+    """Trims an embed to Discord's per-part limits, so one oversized field cannot get a whole log batch rejected"""
+    if embed.title != None:
+        embed.title = embed.title[:256]
+    if embed.description != None and len(embed.description) > 4096:
+        embed.description = embed.description[:4093] + "..."
+    for index, field in enumerate(embed.fields[:25]):
+        if len(field.name) > 256 or len(field.value) > 1024:
+            embed.set_field_at(index, name = field.name[:256], value = field.value[:1021] + "..." if len(field.value) > 1024 else field.value, inline = field.inline)
+    while len(embed.fields) > 25:
+        embed.remove_field(25)
+    if embed.footer.text != None and len(embed.footer.text) > 2048:
+        embed.set_footer(text = embed.footer.text[:2048], icon_url = embed.footer.icon_url)
+    if embed.author.name != None and len(embed.author.name) > 256:
+        embed.set_author(name = embed.author.name[:256], url = embed.author.url, icon_url = embed.author.icon_url)
+    if len(embed) > LogSink.max_embed_chars and embed.description != None:
+        embed.description = embed.description[:max(len(embed.description) - (len(embed) - LogSink.max_embed_chars) - 3, 0)] + "..."
+    return embed
+
+# One log sink per guild, each delivering to that guild's log channel or webhook
+log_sinks = {guild_id: LogSink(guild_id = guild_id,
+                               queue_size = config.log_queue_size,
+                               flush_interval = config.log_flush_interval,
+                               webhook_url = config.log_webhook_url) for guild_id, config in guild_settings.items()}
+
+def log_sinks_for(guild_id: int, user_id: int = None):
+    """Returns the log sink for an event: its guild's, or for a DM the one guild the conversation belongs to"""
+    if guild_id != None:
+        return [log_sinks[guild_id]] if guild_id in log_sinks else []
+    user = bot.get_user(user_id) if user_id != None else None
+    shared = [guild.id for guild in (user.mutual_guilds if user != None else []) if guild.id in log_sinks]
+    # A DM belongs to the guild whose mods last messaged the user, so other guilds' mods never see it
+    last_guild_id = mod_history.last_guild(user_id = user_id, action = "dm") if user_id != None else None
+    if last_guild_id in shared:
+        return [log_sinks[last_guild_id]]
+    if len(shared) == 1:
+        return [log_sinks[shared[0]]]
+    if len(shared) > 1:
+        print(f"DM from user {user_id} not logged: no mod DM history to tell which of {len(shared)} guilds it belongs to")
+    return []
 
 # Chat command: bot sends a normal chat message to a text channel
 @tree.command(
         name = "chat",
         description = "Sends a chat message to the indicated text channel.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     chat_message = "Message to send to text channel",
     channel = "Channel to send the message to",
@@ -96,95 +727,785 @@ async def chat(ctx, chat_message: str, channel: discord.TextChannel, as_reply: s
 @tree.command(
         name = "kill_me",
         description = "You horrible person. What did the lil guy ever do to you?!",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
         reason = "Motive for the murder."
 )
 async def kill_me(ctx: discord.ext.commands.Context, reason: str):
     """Sends a chat message to the indicated text channel."""
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
-    await log_channel.send(f"{ctx.user.global_name} murdered Yupil Bot for: {reason} <:yuyskull:1160100826975567892>")
+    await log_sinks[ctx.guild.id].send(content = f"{ctx.user.global_name} murdered Yupil Bot for: {reason} <:yuyskull:1160100826975567892>", wait = True)
+    await shutdown(reason)
     sys.exit(reason)
 
+async def shutdown(reason: str):
+    """Checkpoints background jobs and persists in-memory state before the process exits"""
+    print(f"Shutting down: {reason}")
+    await job_queue.stop(timeout = settings.job_shutdown_timeout)
+    # Log entries still queued or waiting for the flush interval would otherwise be lost with the process
+    await asyncio.gather(*[sink.flush(timeout = settings.job_shutdown_timeout) for sink in log_sinks.values()])
+    message_store.persist()
+
 
 # DM command: bot sends a DM to a user on the server
+def mod_dm_embed(guild: discord.Guild, user: discord.abc.User, dm_message: str):
+    """Builds the Mod Team message embed sent to a user"""
+    dm_embed = discord.Embed(title = "Mod Team Message",
+                               description = f"Hello {user.mention},\n\n{dm_message}",
+                               color = yupil_color)
+    dm_embed.set_footer(text = "This is a Yupil Bot message on behalf of the Mod Team. If you would like to reach out to a member of the Mod Team, please create a ticket on the server using our ticket system.")
+    dm_embed.set_author(name = guild.name,
+                        icon_url = guild.icon)
+    return dm_embed
+
 @tree.command(
         name = "dm",
         description = "Sends a DM to the indicated user.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     dm_message = "Message to send to user",
     user = "User to send message to"
 )
 async def dm(ctx, dm_message: str, user: discord.User):
     """Sends a DM to the indicated user."""
+    # The log link is only known once the log sink delivers, which can take longer than Discord waits for a response
+    await ctx.response.defer(ephemeral = True)
     dm_message = dm_message.replace(r'\n', '\n')
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
-    guild = await bot.fetch_guild(server_id)
-    dm_embed = discord.Embed(title = "Mod Team Message",
-                               description = f"Hello {user.mention},\n\n{dm_message}",
-                               color = yupil_color)
-    dm_embed.set_footer(text = "This is a Yupil Bot message on behalf of the Mod Team. If you would like to reach out to a member of the Mod Team, please create a ticket on the server using our ticket system.")
-    dm_embed.set_author(name = guild.name,
-                        icon_url = guild.icon)
+    dm_embed = mod_dm_embed(guild = ctx.guild, user = user, dm_message = dm_message)
     await user.send(embed = dm_embed)
     dm_embed.title = f"DM sent to {user.display_name}:"
-    message_log = await log_channel.send(embed = dm_embed)
-    await ctx.response.send_message(f"DM sent to {user.display_name}. View log: {message_log.jump_url}", ephemeral = True)
+    message_log = await log_sinks[ctx.guild.id].send(embed = dm_embed, wait = True)
+    mod_history.record(guild_id = ctx.guild.id, user_id = user.id, action = "dm", actor_id = ctx.user.id, detail = dm_message, reference = message_log.jump_url)
+    await ctx.followup.send(f"DM sent to {user.display_name}. View log: {message_log.jump_url}", ephemeral = True)
+
+# Bulk DM: durable broadcasts with per-recipient status, so an interrupted broadcast resumes where it stopped
+class BroadcastStore:
+    """SQLite record of bulk DM broadcasts and the delivery status of each recipient"""
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, actor_id INTEGER, message TEXT, state TEXT, created_at REAL, finished_at REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS recipients (broadcast_id INTEGER, position INTEGER, user_id INTEGER, status TEXT, PRIMARY KEY (broadcast_id, position))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS recipients_status ON recipients (broadcast_id, status)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS broadcasts_state ON broadcasts (state)")
+        self.db.commit()
+
+    def create(self, guild_id: int, actor_id: int, message: str, user_ids: list):
+        """Records a new broadcast with every recipient pending, returns its ID"""
+        cursor = self.db.execute("INSERT INTO broadcasts (guild_id, actor_id, message, state, created_at) VALUES (?, ?, ?, 'running', ?)",
+                                 (guild_id, actor_id, message, time.time()))
+        self.db.executemany("INSERT INTO recipients VALUES (?, ?, ?, 'pending')",
+                            [(cursor.lastrowid, position, user_id) for position, user_id in enumerate(user_ids)])
+        self.db.commit()
+        return cursor.lastrowid
+
+    def get(self, broadcast_id: int):
+        return self.db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+
+    def pending(self, broadcast_id: int):
+        """Returns the user IDs still to be messaged, in their original order"""
+        rows = self.db.execute("SELECT user_id FROM recipients WHERE broadcast_id = ? AND status = 'pending' ORDER BY position", (broadcast_id,))
+        return [row["user_id"] for row in rows]
+
+    def mark(self, broadcast_id: int, user_id: int, status: str):
+        """Records a recipient's outcome: sent, closed (DMs closed), skipped or failed"""
+        self.db.execute("UPDATE recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?", (status, broadcast_id, user_id))
+        self.db.commit()
+
+    def recipients(self, broadcast_id: int, status: str):
+        rows = self.db.execute("SELECT user_id FROM recipients WHERE broadcast_id = ? AND status = ? ORDER BY position", (broadcast_id, status))
+        return [row["user_id"] for row in rows]
+
+    def counts(self, broadcast_id: int):
+        rows = self.db.execute("SELECT status, COUNT(*) FROM recipients WHERE broadcast_id = ? GROUP BY status", (broadcast_id,))
+        return {status: count for status, count in rows}
+
+    def finish(self, broadcast_id: int):
+        self.db.execute("UPDATE broadcasts SET state = 'finished', finished_at = ? WHERE id = ?", (time.time(), broadcast_id))
+        self.db.commit()
+
+    def unfinished(self):
+        """Returns broadcasts that were interrupted before every recipient was messaged"""
+        return self.db.execute("SELECT * FROM broadcasts WHERE state = 'running' ORDER BY id").fetchall()
+
+broadcast_store = BroadcastStore(path = settings.broadcast_db)
+
+class AdaptivePacer:
+    """Spaces requests out, doubling the interval on rate limits and easing back toward the base after successes"""
+    def __init__(self, interval: float, max_interval: float = 60):
+        self.base_interval = interval
+        self.interval = interval
+        self.max_interval = max_interval
+        self.next_slot = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+    def success(self):
+        self.interval = max(self.base_interval, self.interval * 0.9)
+
+    def rate_limited(self, retry_after: float):
+        self.interval = min(self.interval * 2, self.max_interval)
+        self.next_slot = max(self.next_slot, time.monotonic() + retry_after)
+
+async def run_broadcast(broadcast_id: int, progress = None):
+    """Messages every pending recipient of a broadcast, then posts one summary log entry"""
+    broadcast = broadcast_store.get(broadcast_id)
+    guild = bot.get_guild(broadcast["guild_id"])
+    pending = broadcast_store.pending(broadcast_id)
+    if guild == None or broadcast["guild_id"] not in guild_settings:
+        print(f"Abandoning broadcast {broadcast_id}: guild {broadcast['guild_id']} is not available")
+        broadcast_store.finish(broadcast_id)
+        return
+    semaphore = asyncio.Semaphore(settings.dm_concurrency)
+    pacer = AdaptivePacer(interval = settings.dm_interval)
+    done = [0]
+
+    async def deliver(user_id: int):
+        async with semaphore:
+            status = "failed"
+            try:
+                user = guild.get_member(user_id) or await bot.fetch_user(user_id)
+                if user.bot:
+                    status = "skipped"
+                else:
+                    for attempt in range(5):
+                        await pacer.wait()
+                        try:
+                            await user.send(embed = mod_dm_embed(guild = guild, user = user, dm_message = broadcast["message"]))
+                            pacer.success()
+                            status = "sent"
+                            break
+                        except discord.Forbidden:
+                            # DMs closed or no mutual server
+                            status = "closed"
+                            break
+                        except discord.HTTPException as e:
+                            if e.status != 429 and e.status < 500:
+                                break
+                            retry_after = e.response.headers.get("Retry-After") if e.response != None else None
+                            pacer.rate_limited(float(retry_after) if retry_after else 2 ** attempt)
+            except discord.HTTPException:
+                pass
+            broadcast_store.mark(broadcast_id = broadcast_id, user_id = user_id, status = status)
+            metrics.inc("yupil_bulk_dm_total", {"status": status}, help = "Bulk DM deliveries by outcome")
+        done[0] += 1
+        if progress != None:
+            await progress(done[0], len(pending))
+
+    await asyncio.gather(*[deliver(user_id) for user_id in pending])
+    broadcast_store.finish(broadcast_id)
+
+    # One summary log entry for the whole broadcast
+    counts = broadcast_store.counts(broadcast_id)
+    log_embed = discord.Embed(title = "Mod Action: Bulk DM",
+                              description = broadcast["message"][:4000],
+                              color = yupil_color,
+                              timestamp = datetime.datetime.now())
+    log_embed.add_field(name = "Delivered", value = str(counts.get("sent", 0)))
+    log_embed.add_field(name = "DMs closed", value = str(counts.get("closed", 0)))
+    log_embed.add_field(name = "Failed", value = str(counts.get("failed", 0) + counts.get("skipped", 0)))
+    log_embed.set_footer(text = f"Sent by ID: {broadcast['actor_id']} | Broadcast {broadcast_id}" + (" (resumed)" if progress == None else ""))
+    undelivered = [f"{status}: {user_id}" for status in ("closed", "failed", "skipped") for user_id in broadcast_store.recipients(broadcast_id, status)]
+    files = [discord.File(io.BytesIO("\n".join(undelivered).encode()), filename = f"broadcast-{broadcast_id}-undelivered.txt")] if len(undelivered) > 0 else []
+    message_log = await log_sinks[guild.id].send(embed = log_embed, files = files, wait = True)
+    mod_history.record_many([(guild.id, user_id, "dm", broadcast["actor_id"], broadcast["message"], message_log.jump_url)
+                             for user_id in broadcast_store.recipients(broadcast_id, "sent")])
+    return counts, message_log
+
+# Broadcasts interrupted by a restart are resumed in the background on startup
+broadcast_tasks = set()  # resumed broadcasts, kept referenced until they finish
+
+def resume_broadcast(broadcast_id: int):
+    """Runs an interrupted broadcast in the background"""
+    task = asyncio.create_task(run_broadcast(broadcast_id = broadcast_id))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_finished)
+
+def broadcast_finished(task: asyncio.Task):
+    broadcast_tasks.discard(task)
+    if not task.cancelled() and task.exception() != None:
+        print("Resumed broadcast failed:")
+        traceback.print_exception(task.exception())
+
+# Bulk DM command: sends the Mod Team message to a role and/or a list of users
+@tree.command(
+        name = "dm_bulk",
+        description = "Sends a DM to every member of a role and/or a list of users.",
+        guilds = guild_objects
+)
+@is_mod()
+@ac.describe(
+    dm_message = "Message to send to each user",
+    role = "Role whose members receive the message (default: None)",
+    users = "Users to message, as mentions or IDs separated by spaces (default: None)"
+)
+async def dm_bulk(ctx, dm_message: str, role: discord.Role = None, users: str = None):
+    """Sends a DM to every member of a role and/or a list of users."""
+    dm_message = dm_message.replace(r'\n', '\n')
+    user_ids = {}  # ordered set of recipients
+    if role != None:
+        for member in role.members:
+            if not member.bot:
+                user_ids[member.id] = None
+    if users != None:
+        for user_id in re.findall(r"\d{15,20}", users):
+            user_ids[int(user_id)] = None
+    if len(user_ids) == 0:
+        await ctx.response.send_message("No users to message.", ephemeral = True)
+        return
+    await ctx.response.send_message(f"Sending DM to {len(user_ids)} users.", ephemeral = True)
+    broadcast_id = broadcast_store.create(guild_id = ctx.guild.id, actor_id = ctx.user.id, message = dm_message, user_ids = list(user_ids))
+
+    # Throttle progress edits; the interaction expires after 15 minutes, the broadcast carries on regardless
+    last_progress = [0.0]
+
+    async def progress(done: int, total: int):
+        if done == total or time.monotonic() - last_progress[0] >= 5:
+            last_progress[0] = time.monotonic()
+            try:
+                await ctx.edit_original_response(content = f"Sending DM: {done}/{total} users done.")
+            except discord.HTTPException:
+                pass
+
+    counts, message_log = await run_broadcast(broadcast_id = broadcast_id, progress = progress)
+    try:
+        await ctx.edit_original_response(content = f"DM sent to {counts.get('sent', 0)} of {len(user_ids)} users. View log: {message_log.jump_url}")
+    except discord.HTTPException:
+        pass
+
+# Persistent ticket registry: ticket channel -> owner, type, state and timestamps
+class TicketRegistry:
+    """SQLite registry of ticket channels, indexed by owner, so tickets are found by ID rather than channel name"""
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS tickets (channel_id INTEGER PRIMARY KEY, guild_id INTEGER, owner_id INTEGER, type TEXT, state TEXT, name TEXT, created_at REAL, closed_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tickets_owner ON tickets (owner_id, state)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tickets_state ON tickets (state)")
+        self.db.commit()
+
+    def open(self, channel: discord.TextChannel, owner_id: int, ticket_type: str):
+        """Registers a newly created ticket channel"""
+        self.db.execute("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, 'open', ?, ?, NULL)",
+                        (channel.id, channel.guild.id, owner_id, ticket_type, channel.name, time.time()))
+        self.db.commit()
+
+    def get(self, channel_id: int):
+        return self.db.execute("SELECT * FROM tickets WHERE channel_id = ?", (channel_id,)).fetchone()
+
+    def find_for_user(self, guild_id: int, owner_id: int, ticket_type: str = None):
+        """Returns the user's most recent ticket in a guild that has not been deleted, optionally of one type"""
+        sql = "SELECT * FROM tickets WHERE owner_id = ? AND guild_id = ? AND state != 'deleted'"
+        params = [owner_id, guild_id]
+        if ticket_type != None:
+            sql += " AND type = ?"
+            params.append(ticket_type)
+        return self.db.execute(sql + " ORDER BY created_at DESC LIMIT 1", params).fetchone()
+
+    def set_state(self, channel_id: int, state: str):
+        """Marks a ticket as closed or deleted"""
+        self.db.execute("UPDATE tickets SET state = ?, closed_at = COALESCE(closed_at, ?) WHERE channel_id = ?", (state, time.time(), channel_id))
+        self.db.commit()
+
+    def active(self, guild_id: int):
+        """Returns all open and closed (not yet deleted) tickets, oldest first"""
+        return self.db.execute("SELECT * FROM tickets WHERE guild_id = ? AND state != 'deleted' ORDER BY created_at", (guild_id,)).fetchall()
+
+ticket_registry = TicketRegistry(path = settings.ticket_db)
+
+# Append-only moderation history: mod actions and logged events per user, for /user_history and exports
+class ModHistory:
+    """Append-only SQLite log of mod actions and logged events, indexed by user, action and time"""
+    actions = ("restrict", "unrestrict", "dm", "dm_reply", "message_delete", "message_edit")
+    columns = ("id", "guild_id", "user_id", "action", "actor_id", "created_at", "detail", "reference")
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        # WAL with normal sync keeps a commit per event cheap on the hot deletion/edit paths
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, action TEXT, actor_id INTEGER, created_at REAL, detail TEXT, reference TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_user ON history (guild_id, user_id, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_action ON history (guild_id, action, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_time ON history (guild_id, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_user_any_guild ON history (user_id, action, created_at)")
+        for statement in ("UPDATE", "DELETE"):
+            self.db.execute(f"CREATE TRIGGER IF NOT EXISTS history_no_{statement.lower()} BEFORE {statement} ON history BEGIN SELECT RAISE(ABORT, 'history is append-only'); END")
+        self.db.commit()
+
+    def record(self, guild_id: int, user_id: int, action: str, actor_id: int = None, detail: str = None, reference: str = None):
+        """Appends one entry"""
+        self.record_many([(guild_id, user_id, action, actor_id, detail, reference)])
+
+    def record_many(self, entries: list):
+        """Appends (guild_id, user_id, action, actor_id, detail, reference) entries in one transaction"""
+        now = time.time()
+        self.db.executemany("INSERT INTO history (guild_id, user_id, action, actor_id, created_at, detail, reference) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            [(guild_id, user_id, action, actor_id, now, detail, reference) for guild_id, user_id, action, actor_id, detail, reference in entries])
+        self.db.commit()
+
+    def last_guild(self, user_id: int, action: str):
+        """Returns the guild of the user's most recent entry for an action in any guild, or None"""
+        row = self.db.execute("SELECT guild_id FROM history WHERE user_id = ? AND action = ? ORDER BY created_at DESC LIMIT 1", (user_id, action)).fetchone()
+        return row["guild_id"] if row != None else None
+
+    def _where(self, guild_id: int, user_id: int = None, action: str = None, start: float = None, end: float = None):
+        sql = " WHERE guild_id = ?"
+        params = [guild_id]
+        for clause, value in (("user_id = ?", user_id), ("action = ?", action), ("created_at >= ?", start), ("created_at < ?", end)):
+            if value != None:
+                sql += f" AND {clause}"
+                params.append(value)
+        return sql, params
+
+    def timeline(self, guild_id: int, user_id: int, action: str = None, limit: int = 10, offset: int = 0):
+        """Returns (total, entries) for one page of a user's history, newest first"""
+        where, params = self._where(guild_id = guild_id, user_id = user_id, action = action)
+        total = self.db.execute("SELECT COUNT(*) FROM history" + where, params).fetchone()[0]
+        rows = self.db.execute("SELECT * FROM history" + where + " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        return total, rows
+
+    def export(self, guild_id: int, start: float, end: float, user_id: int = None, action: str = None):
+        """Yields entries in a time range, oldest first, without loading them all at once"""
+        where, params = self._where(guild_id = guild_id, user_id = user_id, action = action, start = start, end = end)
+        yield from self.db.execute("SELECT * FROM history" + where + " ORDER BY created_at, id", params)
+
+mod_history = ModHistory(path = settings.history_db)
+
+# Durable background jobs: long mod operations run as checkpointed steps on a worker pool and resume after a restart
+def transient_error(error: Exception):
+    """Returns True for failures worth retrying: rate limits, Discord server errors and dropped connections"""
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+class JobQueue:
+    """SQLite-backed priority queue of multi-step jobs, run by a pool of workers with a checkpoint after every step"""
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, kind TEXT, priority INTEGER, serial_key TEXT, state TEXT, step INTEGER, payload TEXT, attempts INTEGER, error TEXT, created_at REAL, run_after REAL, finished_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_serial ON jobs (serial_key, state)")
+        # Jobs that were running when the process stopped pick up from their last checkpoint
+        self.db.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+        self.db.commit()
+        self.kinds = {}  # kind -> (priority, [(step name, coroutine function(guild, state))])
+        self.watchers = {}  # job ID -> interaction whose response is cleared when the job ends
+        self.workers = []
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+
+    def register(self, kind: str, priority: int, steps: list):
+        """Registers a job kind; lower priorities run first and steps run in order"""
+        self.kinds[kind] = (priority, steps)
+
+    def enqueue(self, guild_id: int, kind: str, serial_key: str, payload: dict):
+        """Queues a job and returns its ID; jobs sharing a serial key run one at a time in the order they were queued"""
+        cursor = self.db.execute("INSERT INTO jobs (guild_id, kind, priority, serial_key, state, step, payload, attempts, created_at, run_after) VALUES (?, ?, ?, ?, 'queued', 0, ?, 0, ?, 0)",
+                                 (guild_id, kind, self.kinds[kind][0], serial_key, json.dumps(payload), time.time()))
+        self.db.commit()
+        self.wakeup.set()
+        return cursor.lastrowid
+
+    def get(self, job_id: int):
+        return self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def depth(self):
+        """Returns the number of jobs queued or running"""
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')").fetchone()[0]
+
+    def claim(self):
+        """Marks the highest priority runnable job as running and returns it, or None"""
+        job = self.db.execute("""SELECT * FROM jobs AS j WHERE state = 'queued' AND run_after <= ?
+                                 AND NOT EXISTS (SELECT 1 FROM jobs AS e WHERE e.serial_key = j.serial_key AND e.state IN ('queued', 'running') AND e.id < j.id)
+                                 ORDER BY priority, id LIMIT 1""", (time.time(),)).fetchone()
+        if job != None:
+            self.db.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (job["id"],))
+            self.db.commit()
+        return job
+
+    def checkpoint(self, job_id: int, step: int, state: dict):
+        self.db.execute("UPDATE jobs SET step = ?, payload = ? WHERE id = ?", (step, json.dumps(state), job_id))
+        self.db.commit()
+
+    def requeue(self, job_id: int, attempts: int = None, delay: float = 0, error: str = None):
+        """Returns a job to the queue, to continue from its last checkpoint after an optional delay"""
+        self.db.execute("UPDATE jobs SET state = 'queued', attempts = COALESCE(?, attempts), run_after = ?, error = COALESCE(?, error) WHERE id = ?",
+                        (attempts, time.time() + delay, error, job_id))
+        self.db.commit()
+
+    def finish(self, job_id: int, state: str, error: str = None):
+        """Marks a job as done or failed, releasing any jobs waiting on its serial key"""
+        self.db.execute("UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?", (state, error, time.time(), job_id))
+        self.db.commit()
+        self.wakeup.set()
+
+    def start(self, workers: int):
+        self.stopping = False
+        self.workers = [asyncio.create_task(self._work()) for i in range(workers)]
+
+    async def stop(self, timeout: float):
+        """Stops taking jobs and waits for in-flight steps to checkpoint; a step still running at the timeout is cancelled and reruns after a restart"""
+        self.stopping = True
+        self.wakeup.set()
+        if len(self.workers) > 0:
+            done, pending = await asyncio.wait(self.workers, timeout = timeout)
+            for task in pending:
+                task.cancel()
+        self.workers = []
+
+    async def join(self):
+        """Waits until no jobs are queued or running"""
+        while self.depth() > 0:
+            await asyncio.sleep(0.05)
+
+    async def _work(self):
+        while not self.stopping:
+            job = self.claim()
+            if job != None:
+                await self._run(job)
+                continue
+            # Sleep until a job is queued or finishes, or the next retry is due
+            self.wakeup.clear()
+            next_run = self.db.execute("SELECT MIN(run_after) FROM jobs WHERE state = 'queued' AND run_after > ?", (time.time(),)).fetchone()[0]
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout = 5 if next_run == None else min(next_run - time.time(), 5))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: sqlite3.Row):
+        priority, steps = self.kinds[job["kind"]]
+        state = json.loads(job["payload"])
+        step = job["step"]
+        guild = bot.get_guild(job["guild_id"])
+        if guild == None or job["guild_id"] not in guild_settings:
+            self.finish(job_id = job["id"], state = "failed", error = f"Guild {job['guild_id']} is not available")
+            return
+        try:
+            while step < len(steps):
+                if self.stopping:
+                    self.requeue(job_id = job["id"])
+                    return
+                await steps[step][1](guild, state)
+                step += 1
+                self.checkpoint(job_id = job["id"], step = step, state = state)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            attempts = job["attempts"] + 1
+            if transient_error(e) and attempts <= settings.job_retries:
+                self.requeue(job_id = job["id"], attempts = attempts, delay = min(2 ** attempts, 60), error = error)
+                metrics.inc("yupil_jobs_total", {"kind": job["kind"], "status": "retried"}, help = "Background jobs by kind and outcome")
+                return
+            self.finish(job_id = job["id"], state = "failed", error = error)
+            metrics.inc("yupil_jobs_total", {"kind": job["kind"], "status": "failed"}, help = "Background jobs by kind and outcome")
+            embed = discord.Embed(title = "Background Job Failed",
+                                  description = f"Job {job['id']} ({job['kind']}) stopped at step **{steps[step][0]}** after {attempts} attempts.",
+                                  color = discord.Color.dark_gold(),
+                                  timestamp = datetime.datetime.now())
+            embed.add_field(name = "Error", value = error[:1024], inline = False)
+            await log_sinks[guild.id].send(embed = embed)
+            await self._notify(job_id = job["id"], content = f"Job {job['id']} failed at step {steps[step][0]}: {error}"[:2000])
+            return
+        self.finish(job_id = job["id"], state = "done")
+        metrics.inc("yupil_jobs_total", {"kind": job["kind"], "status": "done"}, help = "Background jobs by kind and outcome")
+        await self._notify(job_id = job["id"])
+
+    async def _notify(self, job_id: int, content: str = None):
+        """Clears, or replaces with an error, the response of the interaction that queued a job"""
+        interaction = self.watchers.pop(job_id, None)
+        if interaction == None:
+            return
+        try:
+            if content == None:
+                await interaction.delete_original_response()
+            else:
+                await interaction.edit_original_response(content = content)
+        except discord.HTTPException:
+            pass
+
+job_queue = JobQueue(path = settings.job_db)
 
 # Helper functions for restrict command
-async def create_ticket(name: str, guild: discord.Guild):
-        """Creates a new channel"""
-        category = await bot.fetch_channel(helpdesk_channel)
-        # Set default parameters to view the channel for everyone off and on for the bot
+ticket_timings = collections.deque(maxlen = 100)  # seconds from request to ticket ready, most recent last
+pending_tickets = set()  # (guild ID, user ID) of tickets being provisioned, guarding against duplicate submissions
+
+def record_ticket_timing(seconds: float):
+    ticket_timings.append(seconds)
+    metrics.observe("yupil_ticket_provision_seconds", seconds, help = "Time from ticket request to ticket ready")
+
+def ticket_blocked(guild_id: int, user_id: int, ticket_type: str):
+    """Returns True if the user already has a ticket being provisioned or opened one of this type very recently"""
+    if (guild_id, user_id) in pending_tickets:
+        return True
+    recent = ticket_registry.find_for_user(guild_id = guild_id, owner_id = user_id, ticket_type = ticket_type)
+    return recent != None and recent["state"] == "open" and time.time() - recent["created_at"] < guild_settings[guild_id].ticket_cooldown_seconds
+
+async def create_ticket(name: str, guild: discord.Guild, owner: discord.abc.User = None, ticket_type: str = None, owner_access: bool = True):
+        """Creates a new channel with its complete overwrite map in one call, registering it as a ticket when a type is given"""
+        config = guild_settings[guild.id]
+        category = config.helpdesk_channel or await guild.fetch_channel(config.helpdesk_channel_id)
+        # Set default parameters to view the channel for everyone off and on for the bot and the mod team
         overwrites = {
         guild.default_role: discord.PermissionOverwrite(read_messages = False),
         guild.me: discord.PermissionOverwrite(read_messages = True)
         }
+        if config.mod_role != None:
+            overwrites[config.mod_role] = discord.PermissionOverwrite(read_messages = True, manage_messages = True)
+        if owner != None and owner_access:
+            overwrites[owner] = discord.PermissionOverwrite(read_messages = True)
+        # Deny the quarantine role up front so the reconcile pass has nothing to do for new tickets
+        if config.restrict_mode == "role" and config.quarantine_role != None:
+            overwrites[config.quarantine_role] = discord.PermissionOverwrite(read_messages = False)
         new_channel = await guild.create_text_channel(name = name,
                                                               category = category,
                                                               overwrites = overwrites)
+        if ticket_type != None:
+            ticket_registry.open(channel = new_channel, owner_id = owner.id, ticket_type = ticket_type)
         return new_channel
 
+# Bulk permission overwrite engine shared by restrict, unrestrict and ticket closing
+class OverwriteResult:
+    """Outcome of a single permission overwrite write"""
+    def __init__(self, channel, target, status: str, error: str = None, attempts: int = 0):
+        self.channel = channel
+        self.target = target
+        self.status = status  # "ok", "skipped" or "failed"
+        self.error = error
+        self.attempts = attempts
+
+async def apply_overwrites(jobs: list):
+    """Applies (channel, target, overwrite) jobs concurrently and returns an OverwriteResult per job"""
+    semaphore = asyncio.Semaphore(settings.overwrite_concurrency)
+    # Overwrite routes are bucketed by channel ID, so writes to the same channel are serialized
+    route_locks = {}
+
+    async def apply(channel, target, overwrite):
+        if not channel.permissions_for(channel.guild.me).view_channel:
+            return OverwriteResult(channel, target, "skipped", "Channel not visible to bot")
+        lock = route_locks.setdefault(channel.id, asyncio.Lock())
+        attempts = 0
+        # Wait on the channel first, so a slot is only held by a write that can actually go out
+        async with lock, semaphore:
+            while True:
+                attempts += 1
+                try:
+                    await channel.set_permissions(target, overwrite = overwrite)
+                    return OverwriteResult(channel, target, "ok", attempts = attempts)
+                except discord.HTTPException as e:
+                    retryable = e.status == 429 or e.status >= 500
+                    if not retryable or attempts > settings.overwrite_retries:
+                        return OverwriteResult(channel, target, "failed", f"{e.status} {e.text}", attempts)
+                    retry_after = e.response.headers.get("Retry-After") if e.response != None else None
+                    await asyncio.sleep(float(retry_after) if retry_after else min(2 ** attempts, 30))
+                except Exception as e:
+                    return OverwriteResult(channel, target, "failed", str(e), attempts)
+
+    results = await asyncio.gather(*[apply(channel, target, overwrite) for channel, target, overwrite in jobs])
+    for result in results:
+        metrics.inc("yupil_overwrites_total", {"status": result.status}, help = "Bulk permission overwrite writes by outcome")
+    return results
+
+def add_overwrite_summary(embed: discord.Embed, results: list):
+    """Adds a per-channel summary of bulk overwrite results to a log embed"""
+    counts = {"ok": 0, "skipped": 0, "failed": 0}
+    for result in results:
+        counts[result.status] += 1
+    embed.add_field(name = "Channels updated", value = f"{counts['ok']} updated, {counts['skipped']} skipped, {counts['failed']} failed")
+    failures = [f"<#{result.channel.id}>: {result.error}" for result in results if result.status == "failed"]
+    if len(failures) > 0:
+        failure_text = "\n".join(failures)
+        if len(failure_text) > 1024:
+            failure_text = failure_text[:1000] + "\n..."
+        embed.add_field(name = "Failed channels", value = failure_text, inline = False)
+
+# Snapshots of a user's own channel overwrites taken on restrict, so unrestrict can put back exactly what was there
+class OverwriteSnapshots:
+    """SQLite store of each restricted user's prior per-channel overwrites as (allow, deny) permission bits"""
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS snapshots (guild_id INTEGER, user_id INTEGER, state TEXT, taken_at REAL, restored_at REAL, PRIMARY KEY (guild_id, user_id))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (guild_id INTEGER, user_id INTEGER, channel_id INTEGER, allow INTEGER, deny INTEGER, PRIMARY KEY (guild_id, user_id, channel_id))")
+        self.db.commit()
+
+    def save(self, guild_id: int, user_entries: dict):
+        """Records {user ID: [(channel ID, allow, deny)]} before a restriction; a user who is still restricted keeps their original values"""
+        for user_id, entries in user_entries.items():
+            row = self.db.execute("SELECT state FROM snapshots WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()
+            if row == None or row["state"] == "restored":
+                self.db.execute("DELETE FROM entries WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+                self.db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, 'active', ?, NULL)", (guild_id, user_id, time.time()))
+            self.db.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                [(guild_id, user_id, channel_id, allow, deny) for channel_id, allow, deny in entries])
+        self.db.commit()
+
+    def get(self, guild_id: int, user_id: int):
+        """Returns (state, {channel ID: (allow, deny)}) for a user's latest snapshot, or (None, {}) if there is none"""
+        row = self.db.execute("SELECT state FROM snapshots WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()
+        if row == None:
+            return None, {}
+        rows = self.db.execute("SELECT channel_id, allow, deny FROM entries WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        return row["state"], {channel_id: (allow, deny) for channel_id, allow, deny in rows}
+
+    def mark_restored(self, guild_id: int, user_id: int):
+        self.db.execute("UPDATE snapshots SET state = 'restored', restored_at = ? WHERE guild_id = ? AND user_id = ?", (time.time(), guild_id, user_id))
+        self.db.commit()
+
+overwrite_snapshots = OverwriteSnapshots(path = settings.overwrite_snapshot_db)
+
+def overwrite_bits(channel: discord.abc.GuildChannel, target):
+    """Returns the (allow, deny) permission bits of a target's overwrite on a channel, (0, 0) if it has none"""
+    allow, deny = channel.overwrites_for(target).pair()
+    return allow.value, deny.value
+
 async def user_channels_off(user: discord.User, guild: discord.Guild):
-    """Sets all channel overrides to limit visibility for user"""
-    # Iteratively restrict access to every channel and VC
-    for channel in guild.text_channels:
-        try:
-            if channel.permissions_for(guild.me).view_channel:
-                perms = channel.overwrites_for(user)
-                perms.read_messages = False
-                await channel.set_permissions(user, overwrite = perms)
-        except:
-            print(f"Failed to hide channel {channel.name}. Skipping")
-    for vc in guild.voice_channels:
-        try:
-            if vc.permissions_for(guild.me).view_channel:
-                perms_vc = vc.overwrites_for(user)
-                perms_vc.view_channel = False
-                await vc.set_permissions(user, overwrite = perms_vc)
-        except:
-            print(f"Failed to hide channel {channel.name}. Skipping")
-    for forum in guild.forums:
-        try:
-            if forum.permissions_for(guild.me).view_channel:
-                perms_forum = forum.overwrites_for(user)
-                perms_forum.view_channel = False
-                await forum.set_permissions(user, overwrite = perms_forum)
-        except:
-            print(f"Failed to hide channel {channel.name}. Skipping")
+    """Snapshots the user's channel overrides, then sets them to limit visibility for user where not already hidden"""
+    jobs = []
+    entries = []
+    for channel in restrictable_channels(guild):
+        entries.append((channel.id, *overwrite_bits(channel, user)))
+        perms = channel.overwrites_for(user)
+        if perms.view_channel == False:
+            continue
+        perms.view_channel = False
+        jobs.append((channel, user, perms))
+    overwrite_snapshots.save(guild_id = guild.id, user_entries = {user.id: entries})
+    return await apply_overwrites(jobs)
+
+# Helper functions for role-based quarantine mode
+def restrictable_channels(guild: discord.Guild):
+    """Returns every channel type that a restriction hides"""
+    return guild.text_channels + guild.voice_channels + guild.forums
+
+async def reconcile_restricted_role(guild: discord.Guild, role: discord.Role, channels: list = None):
+    """Denies view for the quarantine role on the given channels (default: all) where it is not already denied"""
+    if channels == None:
+        channels = restrictable_channels(guild)
+    jobs = []
+    for channel in channels:
+        perms = channel.overwrites_for(role)
+        if perms.view_channel != False:
+            perms.view_channel = False
+            jobs.append((channel, role, perms))
+    return await apply_overwrites(jobs)
+
+async def get_restricted_role(guild: discord.Guild, reconcile: bool = False):
+    """Returns the quarantine role, creating it and hiding every channel from it if it does not exist yet"""
+    config = guild_settings[guild.id]
+    role = config.quarantine_role
+    if role == None:
+        role = await guild.create_role(name = config.restricted_role,
+                                       permissions = discord.Permissions.none(),
+                                       reason = "YupilBot quarantine role")
+        config.quarantine_role = role
+        reconcile = True
+    if reconcile:
+        await reconcile_restricted_role(guild = guild, role = role)
+    return role
+
+async def restrict_user(user: discord.User, guild: discord.Guild):
+    """Hides all channels from a user using the configured restriction mode, returns overwrite results if any"""
+    if guild_settings[guild.id].restrict_mode == "role":
+        member = guild.get_member(user.id) or await guild.fetch_member(user.id)
+        await member.add_roles(await get_restricted_role(guild), reason = "Restricted by YupilBot")
+        return []
+    return await user_channels_off(user = user, guild = guild)
+
+async def unrestrict_user(user: discord.User, guild: discord.Guild):
+    """Restores channel visibility for a user using the configured restriction mode, returns overwrite results if any"""
+    if guild_settings[guild.id].restrict_mode == "role":
+        member = guild.get_member(user.id) or await guild.fetch_member(user.id)
+        await member.remove_roles(await get_restricted_role(guild), reason = "Unrestricted by YupilBot")
+        return []
+    return await user_channels_on(user = user, guild = guild)
+
+def refresh_settings(guild: discord.Guild):
+    """Re-resolves a configured guild's settings handles when the guild changes, returning its settings or None"""
+    config = guild_settings.get(guild.id)
+    if config != None:
+        config.resolve(guild)
+    return config
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    refresh_settings(channel.guild)
+    if ticket_registry.get(channel.id) != None:
+        ticket_registry.set_state(channel_id = channel.id, state = "deleted")
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    refresh_settings(role.guild)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    refresh_settings(after.guild)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    refresh_settings(role.guild)
+
+@bot.event
+async def on_guild_update(before: discord.Guild, after: discord.Guild):
+    refresh_settings(after)
+
+# Refresh resolved settings handles and keep the quarantine role hidden from channels as they are created or edited
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    config = refresh_settings(channel.guild)
+    if config == None or config.restrict_mode != "role" or channel not in restrictable_channels(channel.guild):
+        return
+    if config.quarantine_role != None:
+        await reconcile_restricted_role(guild = channel.guild, role = config.quarantine_role, channels = [channel])
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    config = refresh_settings(after.guild)
+    if config == None or config.restrict_mode != "role" or before.overwrites == after.overwrites or after not in restrictable_channels(after.guild):
+        return
+    if config.quarantine_role != None:
+        await reconcile_restricted_role(guild = after.guild, role = config.quarantine_role, channels = [after])
+
+async def open_restrict_ticket(user: discord.User, guild: discord.Guild, send_message: bool = True, custom_message: str = None):
+    """Creates a ticket channel for a restricted user and optionally sends the restriction message"""
+    started = time.monotonic()
+    ticket_name = f"ticket-{user.display_name}"
+    new_channel = await create_ticket(name = ticket_name.lower(), guild = guild, owner = user, ticket_type = "restrict")
+
+    # Send a default or custom restriction embed message in the newly-created channel
+    if send_message:
+        mod_message = "We've identified unusual activity on your account. For this reason, we have temporarily restricted your account from viewing or posting in other channels.\n\nTo have this restriction removed, please send us a message here in this channel at your earliest convenience to confirm that this is not an automated bot account. Failure to respond to this message may result in your removal from the server.\n\nThank you for your patience and cooperation."
+
+        if custom_message != None:
+            mod_message = custom_message.replace(r'\n', '\n')
+
+        message_embed = discord.Embed(description = mod_message,
+                                      color = yupil_color)
+        await new_channel.send(f"Hello, {user.mention}", embed = message_embed)
+    record_ticket_timing(time.monotonic() - started)
+    return new_channel
 
 # Restrict command: bot restricts user permissions to view server channels
 @tree.command(
         name = "restrict",
         description = "Restricts a user.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     user = "User to restrict",
     create_channel = "Whether to create a ticket channel (default: True)",
@@ -193,90 +1514,382 @@ async def user_channels_off(user: discord.User, guild: discord.Guild):
 )
 async def restrict(ctx, user: discord.User, create_channel: bool = True, send_message: bool = True, custom_message: str = None):
     """Restricts a user."""
-    timestamp = datetime.datetime.now()
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
     await ctx.response.send_message(f"Restricting {user.display_name}. This may take some time.", ephemeral = True)
-    await user_channels_off(user = user, guild = ctx.guild)
+    job_id = job_queue.enqueue(guild_id = ctx.guild.id, kind = "restrict", serial_key = f"user:{ctx.guild.id}:{user.id}",
+                               payload = {"user_id": user.id, "actor_id": ctx.user.id, "timestamp": time.time(), "create_channel": create_channel,
+                                          "send_message": send_message, "custom_message": custom_message})
+    job_queue.watchers[job_id] = ctx
+
+# Helper functions for bulk restrict command
+async def resolve_bulk_targets(guild: discord.Guild, users: str = None, joined_within: int = None):
+    """Resolves members from a list of mentions/IDs and/or everyone who joined in the last N minutes"""
+    targets = {}
+    if users != None:
+        for user_id in re.findall(r"\d{15,20}", users):
+            member = guild.get_member(int(user_id))
+            if member == None:
+                try:
+                    member = await guild.fetch_member(int(user_id))
+                except discord.HTTPException:
+                    continue
+            targets[member.id] = member
+    if joined_within != None:
+        cutoff = discord.utils.utcnow() - datetime.timedelta(minutes = joined_within)
+        for member in guild.members:
+            if member.joined_at != None and member.joined_at >= cutoff:
+                targets[member.id] = member
+    # Never restrict bots or the mod team
+    mod_role = guild_settings[guild.id].mod_role
+    return [member for member in targets.values() if not member.bot and mod_role not in member.roles]
+
+async def members_channels_off(members: list, guild: discord.Guild, progress = None):
+    """Hides every channel from many members, applying each channel's overwrites for all members in one pass"""
+    channels = restrictable_channels(guild)
+    overwrite_snapshots.save(guild_id = guild.id, user_entries = {member.id: [(channel.id, *overwrite_bits(channel, member)) for channel in channels] for member in members})
+    results = []
+    # Work through a few channels at a time so progress can be reported between passes
+    for i in range(0, len(channels), settings.overwrite_concurrency):
+        jobs = []
+        for channel in channels[i:i + settings.overwrite_concurrency]:
+            for member in members:
+                perms = channel.overwrites_for(member)
+                if perms.view_channel == False:
+                    continue
+                perms.view_channel = False
+                jobs.append((channel, member, perms))
+        results += await apply_overwrites(jobs)
+        if progress != None:
+            await progress(min(i + settings.overwrite_concurrency, len(channels)), len(channels))
+    return results
+
+async def members_role_on(members: list, role: discord.Role, reason: str):
+    """Adds the quarantine role to many members concurrently, returning (member, error) for each one that failed"""
+    semaphore = asyncio.Semaphore(settings.overwrite_concurrency)
+
+    async def add_role(member: discord.Member):
+        async with semaphore:
+            await member.add_roles(role, reason = reason)
+    results = await asyncio.gather(*[add_role(member) for member in members], return_exceptions = True)
+    return [(member, result) for member, result in zip(members, results) if isinstance(result, Exception)]
+
+def add_role_failures(embed: discord.Embed, failures: list):
+    """Adds the members whose quarantine role could not be added to a log embed"""
+    if len(failures) > 0:
+        failure_text = "\n".join(f"{member.mention}: {error}" for member, error in failures)
+        if len(failure_text) > 1024:
+            failure_text = failure_text[:1000] + "\n..."
+        embed.add_field(name = f"Role not added ({len(failures)})", value = failure_text, inline = False)
+
+# Bulk restrict command: restricts a list of users and/or recent joins in one pipelined operation
+@tree.command(
+        name = "restrict_bulk",
+        description = "Restricts many users at once.",
+        guilds = guild_objects
+)
+@is_mod()
+@ac.describe(
+    users = "Users to restrict, as mentions or IDs separated by spaces (default: None)",
+    joined_within = "Also restrict everyone who joined in the last N minutes (default: None)",
+    create_channel = "Whether to create a ticket channel for each user (default: False)",
+    send_message = "Whether to send a mod message in each ticket, sends a default message if no custom_message given (default: True)",
+    custom_message = "Custom mod message (default: None)"
+)
+async def restrict_bulk(ctx, users: str = None, joined_within: int = None, create_channel: bool = False, send_message: bool = True, custom_message: str = None):
+    """Restricts many users at once."""
+    timestamp = datetime.datetime.now()
+    await ctx.response.send_message("Resolving users to restrict.", ephemeral = True)
+
+    # Progress is best effort: the interaction expires after 15 minutes, the restriction carries on regardless
+    async def report(content: str):
+        try:
+            await ctx.edit_original_response(content = content)
+        except discord.HTTPException:
+            pass
+
+    members = await resolve_bulk_targets(guild = ctx.guild, users = users, joined_within = joined_within)
+    if len(members) == 0:
+        await report("No users to restrict.")
+        return
+
+    # Throttle progress edits so reporting does not compete with the overwrites for rate limits
+    last_progress = [0.0]
+
+    async def progress(done: int, total: int):
+        if done == total or time.monotonic() - last_progress[0] >= 2:
+            last_progress[0] = time.monotonic()
+            await report(f"Restricting {len(members)} users: {done}/{total} channels done.")
+
+    overwrite_results = []
+    failed_roles = []
+    if guild_settings[ctx.guild.id].restrict_mode == "role":
+        failed_roles = await members_role_on(members = members, role = await get_restricted_role(ctx.guild), reason = "Restricted by YupilBot")
+    else:
+        overwrite_results = await members_channels_off(members = members, guild = ctx.guild, progress = progress)
+    failed_ids = {member.id for member, error in failed_roles}
+    restricted = [member for member in members if member.id not in failed_ids]
 
-    # Create a new ticket channel and set permissions for both the restricted user and permitted users (mods)
+    # Create ticket channels in batches of concurrent requests
+    failed_tickets = []
     if create_channel:
-        ticket_name = f"ticket-{user.display_name}"
-        new_channel = await create_ticket(name = ticket_name.lower(), guild = ctx.guild)
-        new_perms = new_channel.overwrites_for(user)
-        new_perms.read_messages = True
-        mod_role = discord.utils.get(ctx.guild.roles, name = permitted_role)
-        mod_perms = new_channel.overwrites_for(mod_role)
-        mod_perms.read_messages = True
-        mod_perms.manage_messages = True
-        await new_channel.set_permissions(user, overwrite = new_perms)
-        await new_channel.set_permissions(mod_role, overwrite = mod_perms)
-        
-        # Send a default or custom restriction embed message in the newly-created channel
-        if send_message:
-            mod_message = "We've identified unusual activity on your account. For this reason, we have temporarily restricted your account from viewing or posting in other channels.\n\nTo have this restriction removed, please send us a message here in this channel at your earliest convenience to confirm that this is not an automated bot account. Failure to respond to this message may result in your removal from the server.\n\nThank you for your patience and cooperation."
-            
-            if custom_message != None:
-                mod_message = custom_message.replace(r'\n', '\n')
-
-            message_embed = discord.Embed(description = mod_message,
-                                          color = yupil_color)
-            await new_channel.send(f"Hello, {user.mention}", embed = message_embed)
-
-    # Send a log of the mod action
-    log_embed = discord.Embed(title = "Mod Action: Restrict",
-                          description = f"{user.mention} has been restricted.",
-                          color = discord.Color.red(), 
-                          timestamp = timestamp)
-    user_avatar = None
-    if user.avatar != None:
-        user_avatar = user.avatar.url
-    log_embed.set_author(name = user,
-                     icon_url = user_avatar)
-    await log_channel.send(embed = log_embed)
-    await ctx.delete_original_response()
+        await report(f"Creating {len(restricted)} ticket channels.")
+        semaphore = asyncio.Semaphore(settings.overwrite_concurrency)
+
+        async def open_ticket(member: discord.Member):
+            async with semaphore:
+                try:
+                    await open_restrict_ticket(user = member, guild = ctx.guild, send_message = send_message, custom_message = custom_message)
+                except discord.HTTPException:
+                    failed_tickets.append(member)
+        await asyncio.gather(*[open_ticket(member) for member in restricted])
+
+    # Send a single log of the mod action listing everyone affected
+    mentions = " ".join(member.mention for member in restricted)
+    if len(mentions) > 4000:
+        mentions = mentions[:4000] + " ..."
+    log_embed = discord.Embed(title = "Mod Action: Bulk Restrict",
+                              description = f"{len(restricted)} users have been restricted.\n{mentions}",
+                              color = discord.Color.red(),
+                              timestamp = timestamp)
+    log_embed.set_footer(text = f"Restricted by {ctx.user} | ID: {ctx.user.id}")
+    if len(overwrite_results) > 0:
+        add_overwrite_summary(embed = log_embed, results = overwrite_results)
+    add_role_failures(embed = log_embed, failures = failed_roles)
+    if len(failed_tickets) > 0:
+        log_embed.add_field(name = "Ticket creation failed", value = " ".join(member.mention for member in failed_tickets)[:1024], inline = False)
+    await log_sinks[ctx.guild.id].send(embed = log_embed)
+    mod_history.record_many([(ctx.guild.id, member.id, "restrict", ctx.user.id, "Bulk restrict", None) for member in restricted])
+    await report(f"Restricted {len(restricted)} of {len(members)} users." if len(failed_roles) > 0 else f"Restricted {len(members)} users.")
 
 # Helper functions for unrestrict command
+def plan_overwrite_restore(user: discord.User, guild: discord.Guild):
+    """Returns (snapshot state, jobs) that put the user's overwrites back as they were before the restriction, skipping channels that already match"""
+    state, entries = overwrite_snapshots.get(guild_id = guild.id, user_id = user.id)
+    if state == "restored":
+        return state, []
+    jobs = []
+    for channel in restrictable_channels(guild):
+        current = overwrite_bits(channel, user)
+        if state == None:
+            # Restricted before snapshots were kept: clear the user's overwrites wherever there is one
+            if current != (0, 0):
+                jobs.append((channel, user, None))
+            continue
+        # Channels created since the restriction were never changed by it
+        if channel.id not in entries or entries[channel.id] == current:
+            continue
+        allow, deny = entries[channel.id]
+        overwrite = discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny)) if (allow, deny) != (0, 0) else None
+        jobs.append((channel, user, overwrite))
+    return state, jobs
+
 async def user_channels_on(user: discord.User, guild: discord.Guild):
-    """Resets all user-specific channel overrides established by previous restriction"""
-    # Iteratively restore normal access to all channels and VCs
-    for channel in guild.text_channels:
-        try:
-            if channel.permissions_for(guild.me).view_channel:
-                await channel.set_permissions(user, overwrite = None)
-        except:
-            print(f"Failed to reveal channel {channel.name}. Skipping")
-    for vc in guild.voice_channels:
+    """Restores the user's channel overrides from the snapshot taken when they were restricted, writing only channels that differ"""
+    state, jobs = plan_overwrite_restore(user = user, guild = guild)
+    results = await apply_overwrites(jobs)
+    if state == "active" and all(result.status != "failed" for result in results):
+        overwrite_snapshots.mark_restored(guild_id = guild.id, user_id = user.id)
+    return results
+
+def overwrite_plan_embed(user: discord.User, guild: discord.Guild):
+    """Describes what unrestricting a user would change, without changing anything"""
+    config = guild_settings[guild.id]
+    embed = discord.Embed(title = f"Unrestrict dry run: {user.display_name}"[:256],
+                          color = yupil_color)
+    if config.restrict_mode == "role":
+        embed.description = f"Would remove the {config.restricted_role} role."
+        return embed
+    state, jobs = plan_overwrite_restore(user = user, guild = guild)
+    notes = {None: "No snapshot from the restriction, so the user's overwrites would be removed.",
+             "active": "Overwrites would be restored to their values from before the restriction.",
+             "restored": "Overwrites were already restored, nothing to change."}
+    lines = []
+    for channel, target, overwrite in jobs:
+        if overwrite == None:
+            lines.append(f"<#{channel.id}>: remove overwrite")
+        else:
+            allowed = ", ".join(name for name, value in overwrite if value == True) or "nothing"
+            denied = ", ".join(name for name, value in overwrite if value == False) or "nothing"
+            lines.append(f"<#{channel.id}>: allow {allowed}; deny {denied}")
+    description = "\n".join([notes[state], f"Channels to change: {len(jobs)}"] + lines)
+    embed.description = description if len(description) <= 4000 else description[:4000] + "\n..."
+    return embed
+
+# Transcript rendering: "stream" renders history page by page straight to a compressed file, "rich" uses chat_exporter
+transcript_tz = zoneinfo.ZoneInfo("US/Pacific")
+
+def render_transcript_message(message: discord.Message):
+    """Renders one message as an HTML block"""
+    timestamp = message.created_at.astimezone(transcript_tz).strftime("%Y-%m-%d %H:%M:%S %Z")
+    parts = [f'<div class="message" data-id="{message.id}" data-author-id="{message.author.id}" data-timestamp="{message.created_at.isoformat()}">',
+             f'<span class="author">{html.escape(str(message.author))}</span> <span class="timestamp">{timestamp}</span>',
+             f'<div class="content">{html.escape(message.content)}</div>']
+    for embed in message.embeds:
+        parts.append(f'<div class="embed"><b>{html.escape(embed.title or "")}</b><br>{html.escape(embed.description or "")}</div>')
+    for attachment in message.attachments:
+        parts.append(f'<div class="attachment"><a href="{html.escape(attachment.url)}">{html.escape(attachment.filename)}</a></div>')
+    parts.append("</div>\n")
+    return "".join(parts)
+
+async def render_transcript(channel: discord.TextChannel, path: str):
+    """Writes a channel's transcript to a gzip-compressed HTML file without holding the whole history in memory"""
+    with gzip.open(path, "wt", encoding = "utf-8") as transcript_file:
+        if guild_settings[channel.guild.id].transcript_style == "rich":
+            import chat_exporter
+            transcript_file.write(await chat_exporter.export(channel, tz_info = "US/Pacific"))
+            return
+        transcript_file.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(channel.name)}</title>"
+                              "<style>body{font-family:sans-serif}.message{margin:8px 0}.author{font-weight:bold}"
+                              ".timestamp{color:#888;font-size:small}.content{white-space:pre-wrap}</style></head><body>\n")
+        # History is fetched and written one page at a time
+        async for message in channel.history(limit = None, oldest_first = True):
+            transcript_file.write(render_transcript_message(message))
+        transcript_file.write("</body></html>\n")
+
+# Full-text index over archived transcripts
+class TranscriptParser(html.parser.HTMLParser):
+    """Extracts (author, timestamp, content) records from stream-style and chat_exporter transcripts"""
+    fields = {"author": "author", "chatlog__author-name": "author", "chatlog__author": "author",
+              "timestamp": "timestamp", "chatlog__timestamp": "timestamp",
+              "content": "content", "chatlog__content": "content"}
+    void_tags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+    def __init__(self, on_record):
+        super().__init__()
+        self.on_record = on_record
+        self.depth = 0
+        self.capturing = None  # (field, depth) of the element whose text is being collected
+        self.text = []
+        self.author = ""
+        self.timestamp = ""
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.void_tags:
+            return
+        self.depth += 1
+        if self.capturing == None:
+            for css_class in (dict(attrs).get("class") or "").split():
+                if css_class in self.fields:
+                    self.capturing = (self.fields[css_class], self.depth)
+                    self.text = []
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in self.void_tags:
+            return
+        if self.capturing != None and self.capturing[1] == self.depth:
+            field, text = self.capturing[0], " ".join("".join(self.text).split())
+            self.capturing = None
+            if field == "author":
+                self.author = text
+            elif field == "timestamp":
+                self.timestamp = text
+            elif text != "":
+                # Grouped chat_exporter messages only name the author once, so the last author carries over
+                self.on_record(self.author, self.timestamp, text)
+        self.depth -= 1
+
+    def handle_data(self, data):
+        if self.capturing != None:
+            self.text.append(data)
+
+class TranscriptIndex:
+    """SQLite FTS5 index over the messages, authors and timestamps of archived transcripts"""
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # WAL lets searches read while a transcript is being indexed from another thread
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS transcripts (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, channel TEXT, indexed_at REAL, guild_id INTEGER)")
+        self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS transcript_messages USING fts5 (content, author, timestamp UNINDEXED, transcript_id UNINDEXED, tokenize = 'porter unicode61')")
+        if "guild_id" not in [row[1] for row in self.db.execute("PRAGMA table_info(transcripts)")]:
+            self.db.execute("ALTER TABLE transcripts ADD COLUMN guild_id INTEGER")
+        # Transcripts indexed before guilds were recorded can only belong to a single-guild deployment
+        if len(guild_ids) == 1:
+            self.db.execute("UPDATE transcripts SET guild_id = ? WHERE guild_id IS NULL", (guild_ids[0],))
+        self.db.execute("CREATE INDEX IF NOT EXISTS transcripts_guild ON transcripts (guild_id)")
+        self.db.commit()
+
+    def is_indexed(self, filename: str):
+        return self.db.execute("SELECT 1 FROM transcripts WHERE filename = ?", (filename,)).fetchone() != None
+
+    def add(self, path: str, guild_id: int, channel: str = None):
+        """Indexes one guild's transcript file, streaming it through the parser; returns the number of messages indexed.
+        Uses its own connection, so it can run in a worker thread with asyncio.to_thread"""
+        filename = os.path.basename(path)
+        if channel == None:
+            # Filenames look like YYYY-MM-DD-<channel>[-n].html[.gz]
+            channel = filename.split(".")[0][11:]
+        db = sqlite3.connect(self.path)
         try:
-            if vc.permissions_for(guild.me).view_channel:
-                await vc.set_permissions(user, overwrite = None)
-        except:
-            print(f"Failed to reveal channel {channel.name}. Skipping")
-    for forum in guild.forums:
+            if db.execute("SELECT 1 FROM transcripts WHERE filename = ?", (filename,)).fetchone() != None:
+                return 0
+            transcript_id = db.execute("INSERT INTO transcripts (filename, channel, indexed_at, guild_id) VALUES (?, ?, ?, ?)",
+                                       (filename, channel, time.time(), guild_id)).lastrowid
+            rows = []
+
+            def on_record(author: str, timestamp: str, content: str):
+                rows.append((content, author, timestamp, transcript_id))
+                if len(rows) >= 500:
+                    db.executemany("INSERT INTO transcript_messages VALUES (?, ?, ?, ?)", rows)
+                    rows.clear()
+            parser = TranscriptParser(on_record)
+            opener = gzip.open if filename.endswith(".gz") else open
+            with opener(path, "rt", encoding = "utf-8", errors = "replace") as transcript_file:
+                for chunk in iter(lambda: transcript_file.read(65536), ""):
+                    parser.feed(chunk)
+            parser.close()
+            db.executemany("INSERT INTO transcript_messages VALUES (?, ?, ?, ?)", rows)
+            db.commit()
+            return db.execute("SELECT COUNT(*) FROM transcript_messages WHERE transcript_id = ?", (transcript_id,)).fetchone()[0]
+        finally:
+            db.close()
+
+    def search(self, guild_id: int, query: str, limit: int = 10):
+        """Returns ranked (filename, channel, author, timestamp, snippet) matches from one guild's transcripts"""
+        sql = ("SELECT t.filename, t.channel, m.author, m.timestamp, snippet(transcript_messages, 0, '**', '**', '...', 16) "
+               "FROM transcript_messages m JOIN transcripts t ON t.id = m.transcript_id "
+               "WHERE transcript_messages MATCH ? AND t.guild_id = ? ORDER BY bm25(transcript_messages) LIMIT ?")
         try:
-            if forum.permissions_for(guild.me).view_channel:
-                await forum.set_permissions(user, overwrite = None)
-        except:
-            print(f"Failed to reveal channel {channel.name}. Skipping")
+            return self.db.execute(sql, (query, guild_id, limit)).fetchall()
+        except sqlite3.OperationalError:
+            # Not valid FTS5 query syntax, so search for the text as a phrase
+            return self.db.execute(sql, ('"' + query.replace('"', '""') + '"', guild_id, limit)).fetchall()
+
+def backfill_transcripts(guild_id: int = None):
+    """Indexes every archived transcript that is not in the index yet, for the given guild or the only configured one"""
+    if not os.path.isdir("transcripts"):
+        print("No transcripts directory found.")
+        return
+    if guild_id == None:
+        if len(guild_ids) > 1:
+            print("Several guilds are configured; give the guild ID the transcripts belong to: backfill_transcripts <guild ID>")
+            return
+        guild_id = guild_ids[0]
+    for filename in sorted(os.listdir("transcripts")):
+        if filename.endswith((".html", ".html.gz")) and not transcript_index.is_indexed(filename):
+            print(f"Indexed {transcript_index.add(f'transcripts/{filename}', guild_id = guild_id)} messages from {filename}")
+
+os.makedirs("transcripts", exist_ok = True)
+transcript_index = TranscriptIndex(path = settings.transcript_index_db)
 
 async def create_transcript(channel: discord.TextChannel):
-    """Creates two transcripts: one to send in the transcript channel and one to save locally for long-term archival"""
-    transcript_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['transcript_channel']))
+    """Renders a transcript to a local file for long-term archival, then uploads that file to the transcript channel"""
+    transcript_channel = guild_settings[channel.guild.id].transcript_channel
     today = datetime.date.today()
     today_format = f"{today.year}-{'%02d' % today.month}-{'%02d' % today.day}"
-    transcript = await chat_exporter.export(channel, tz_info = "US/Pacific")
-    filename = f"{today_format}-{channel.name}.html"
-    transcript_file = discord.File(io.BytesIO(transcript.encode()),
-                                   filename = filename)
-    transcript_message = await transcript_channel.send(file = transcript_file)
+    filename = f"{today_format}-{channel.name}.html.gz"
     # If directory doesn't exist, create it
     if not os.path.isdir("transcripts"):
         os.mkdir("transcripts")
     # If file already exists, rename rather than overwrite
     i = 1
     while os.path.isfile(f"transcripts/{filename}"):
-        filename = f"{today_format}-{channel.name}-{i}.html"
+        filename = f"{today_format}-{channel.name}-{i}.html.gz"
         i += 1
-    await transcript_message.attachments[0].save(f"transcripts/{filename}")
+    await render_transcript(channel = channel, path = f"transcripts/{filename}")
+    # Parsing and indexing a long transcript takes seconds, so it runs off the event loop
+    await asyncio.to_thread(transcript_index.add, path = f"transcripts/{filename}", guild_id = channel.guild.id, channel = channel.name)
+    transcript_message = await transcript_channel.send(file = discord.File(f"transcripts/{filename}", filename = filename))
     embed = discord.Embed(title = "Transcript Created",
                           description = None,
                           color = discord.Color.green(),
@@ -285,65 +1898,327 @@ async def create_transcript(channel: discord.TextChannel):
     embed.add_field(name = "Transcript file", value = transcript_message.attachments[0].url, inline = False)
     await transcript_message.edit(embed = embed, attachments = [])
 
+# Background job steps for restrict, unrestrict and ticket transcripts; each step's changes to state are checkpointed
+async def job_user(guild: discord.Guild, state: dict):
+    return guild.get_member(state["user_id"]) or await bot.fetch_user(state["user_id"])
+
+async def job_notice(guild: discord.Guild, state: dict, content: str):
+    """Posts a notice in the channel the job was started from, as the command used to"""
+    channel = guild.get_channel(state.get("reply_channel_id"))
+    if channel != None:
+        await channel.send(content)
+
+def stored_overwrite_results(rows: list):
+    """Rebuilds overwrite results checkpointed as (channel ID, status, error), enough for add_overwrite_summary"""
+    return [OverwriteResult(discord.Object(id = channel_id), None, status, error) for channel_id, status, error in rows]
+
+def mod_action_embed(title: str, description: str, color: discord.Color, user: discord.abc.User, state: dict):
+    """Builds the log embed for a restrict or unrestrict job, timestamped when the command was run"""
+    embed = discord.Embed(title = title,
+                          description = description,
+                          color = color,
+                          timestamp = datetime.datetime.fromtimestamp(state["timestamp"]))
+    user_avatar = None
+    if user.avatar != None:
+        user_avatar = user.avatar.url
+    embed.set_author(name = user,
+                     icon_url = user_avatar)
+    if len(state["overwrites"]) > 0:
+        add_overwrite_summary(embed = embed, results = stored_overwrite_results(rows = state["overwrites"]))
+    return embed
+
+async def restrict_overwrites_step(guild: discord.Guild, state: dict):
+    results = await restrict_user(user = await job_user(guild, state), guild = guild)
+    state["overwrites"] = [[result.channel.id, result.status, result.error] for result in results]
+
+async def restrict_ticket_step(guild: discord.Guild, state: dict):
+    """Creates the ticket channel and sends the restriction message"""
+    if not state["create_channel"]:
+        return
+    user = await job_user(guild, state)
+    # A rerun after an interruption reuses the ticket the first attempt created
+    ticket = ticket_registry.find_for_user(guild_id = guild.id, owner_id = user.id, ticket_type = "restrict")
+    if ticket != None and ticket["state"] == "open" and ticket["created_at"] >= state["timestamp"]:
+        return
+    await open_restrict_ticket(user = user, guild = guild, send_message = state["send_message"], custom_message = state["custom_message"])
+
+async def restrict_log_step(guild: discord.Guild, state: dict):
+    user = await job_user(guild, state)
+    log_embed = mod_action_embed(title = "Mod Action: Restrict", description = f"{user.mention} has been restricted.",
+                                 color = discord.Color.red(), user = user, state = state)
+    # Wait for delivery so the step is only checkpointed once the entry is in the log channel
+    await log_sinks[guild.id].send(embed = log_embed, wait = True)
+    mod_history.record(guild_id = guild.id, user_id = user.id, action = "restrict", actor_id = state["actor_id"], detail = state["custom_message"])
+
+async def unrestrict_overwrites_step(guild: discord.Guild, state: dict):
+    results = await unrestrict_user(user = await job_user(guild, state), guild = guild)
+    state["overwrites"] = [[result.channel.id, result.status, result.error] for result in results]
+
+async def unrestrict_transcript_step(guild: discord.Guild, state: dict):
+    """Saves the restrict ticket's transcript; the ticket is only deleted once this step has checkpointed"""
+    state["ticket_channel_id"] = None
+    if not state["delete_ticket"]:
+        return
+    user = await job_user(guild, state)
+    ticket_name = f"ticket-{user.display_name}"
+    ticket = ticket_registry.find_for_user(guild_id = guild.id, owner_id = user.id, ticket_type = "restrict")
+    if ticket != None:
+        ticket_channel = guild.get_channel(ticket["channel_id"])
+    else:
+        # Tickets created before the registry existed can only be found by name
+        ticket_channel = discord.utils.get(guild.channels, name = ticket_name.lower())
+    if ticket_channel == None:
+        await job_notice(guild = guild, state = state, content = f"Ticket channel {ticket_name} not found.")
+        return
+    try:
+        await create_transcript(channel = ticket_channel)
+    except Exception as e:
+        if transient_error(e):
+            raise
+        await job_notice(guild = guild, state = state, content = f"Unable to create transcript for {ticket_channel.name}.")
+        return
+    state["ticket_channel_id"] = ticket_channel.id
+
+async def unrestrict_delete_step(guild: discord.Guild, state: dict):
+    ticket_channel = guild.get_channel(state["ticket_channel_id"]) if state["ticket_channel_id"] != None else None
+    if ticket_channel != None:
+        await ticket_channel.delete()
+
+async def unrestrict_log_step(guild: discord.Guild, state: dict):
+    user = await job_user(guild, state)
+    embed = mod_action_embed(title = "Mod Action: Unrestrict", description = f"{user.mention} has been unrestricted.",
+                             color = discord.Color.green(), user = user, state = state)
+    await log_sinks[guild.id].send(embed = embed, wait = True)
+    mod_history.record(guild_id = guild.id, user_id = user.id, action = "unrestrict", actor_id = state["actor_id"])
+
+async def ticket_transcript_step(guild: discord.Guild, state: dict):
+    state["saved"] = False
+    channel = guild.get_channel(state["channel_id"])
+    if channel == None:
+        return
+    try:
+        await create_transcript(channel = channel)
+    except Exception as e:
+        if transient_error(e):
+            raise
+        await channel.send("Unable to save transcript.")
+        return
+    state["saved"] = True
+
+async def ticket_delete_step(guild: discord.Guild, state: dict):
+    channel = guild.get_channel(state["channel_id"])
+    if state["saved"] and channel != None:
+        ticket_registry.set_state(channel_id = channel.id, state = "deleted")
+        await channel.delete()
+
+# Restrictions run ahead of unrestrictions, and both ahead of transcript archiving
+job_queue.register("restrict", priority = 0, steps = [("overwrites", restrict_overwrites_step),
+                                                      ("ticket", restrict_ticket_step),
+                                                      ("log", restrict_log_step)])
+job_queue.register("unrestrict", priority = 1, steps = [("overwrites", unrestrict_overwrites_step),
+                                                        ("transcript", unrestrict_transcript_step),
+                                                        ("delete ticket", unrestrict_delete_step),
+                                                        ("log", unrestrict_log_step)])
+job_queue.register("ticket_transcript", priority = 2, steps = [("transcript", ticket_transcript_step),
+                                                               ("delete ticket", ticket_delete_step)])
+
+
+# Search command: full-text search over archived ticket transcripts
+@tree.command(
+        name = "search_transcripts",
+        description = "Searches archived ticket transcripts.",
+        guilds = guild_objects
+)
+@is_mod()
+@ac.describe(
+    query = "Words or phrase to search for (supports AND, OR, NOT and \"quoted phrases\")",
+    limit = "Maximum number of results (default: 10)"
+)
+async def search_transcripts(ctx, query: str, limit: ac.Range[int, 1, 25] = 10):
+    """Searches archived ticket transcripts."""
+    results = transcript_index.search(guild_id = ctx.guild.id, query = query, limit = limit)
+    embed = discord.Embed(title = f"Transcript search: {query}"[:256],
+                          description = None if len(results) > 0 else "No matches found.",
+                          color = yupil_color)
+    for filename, channel, author, timestamp, snippet in results:
+        embed.add_field(name = f"{filename} | {author} {timestamp}"[:256], value = snippet[:1024], inline = False)
+    await ctx.response.send_message(embed = embed, ephemeral = True)
 
 # Unrestrict command: bot unrestricts user permissions to view server channels
 @tree.command(
         name = "unrestrict",
         description = "Unrestricts a user.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     user = "User to unrestrict",
-    delete_ticket = "Whether to save a transcript and delete the ticket (default: True)"
+    delete_ticket = "Whether to save a transcript and delete the ticket (default: True)",
+    dry_run = "Only show which channel overwrites would change (default: False)"
 )
-async def unrestrict(ctx, user: discord.User, delete_ticket: bool = True):
+async def unrestrict(ctx, user: discord.User, delete_ticket: bool = True, dry_run: bool = False):
     """Unrestricts a user."""
-    timestamp = datetime.datetime.now()
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
+    if dry_run:
+        await ctx.response.send_message(embed = overwrite_plan_embed(user = user, guild = ctx.guild), ephemeral = True)
+        return
     await ctx.response.send_message(f"Unrestricting {user.display_name}. This may take some time.", ephemeral = True)
-    await user_channels_on(user = user, guild = ctx.guild)
-
-    # Search for and delete the ticket channel associated with the prior restriction
-    if delete_ticket:
-        try:
-            ticket_name = f"ticket-{user.display_name}"
-            ticket_channel = discord.utils.get(ctx.guild.channels, name = ticket_name.lower())
-            try:
-                await create_transcript(channel = ticket_channel)
-                await ticket_channel.delete()
-            except:
-                await ctx.channel.send(f"Unable to create transcript for {ticket_channel.name}.")
-        except:
-            await ctx.channel.send(f"Ticket channel {ticket_name} not found.")
-
-    # Send a log of the mod action
-    embed = discord.Embed(title = "Mod Action: Unrestrict",
-                          description = f"{user.mention} has been unrestricted.",
-                          color = discord.Color.green(), 
-                          timestamp = timestamp)
-    user_avatar = None
-    if user.avatar != None:
-        user_avatar = user.avatar.url
-    embed.set_author(name = user,
-                     icon_url = user_avatar)
-    await log_channel.send(embed = embed)
-    await ctx.delete_original_response()
+    job_id = job_queue.enqueue(guild_id = ctx.guild.id, kind = "unrestrict", serial_key = f"user:{ctx.guild.id}:{user.id}",
+                               payload = {"user_id": user.id, "actor_id": ctx.user.id, "timestamp": time.time(), "delete_ticket": delete_ticket,
+                                          "reply_channel_id": ctx.channel.id})
+    job_queue.watchers[job_id] = ctx
 
 # Translation command using DeepL API
 @tree.command(
         name = "translate",
         description = "Translates text to English (EN-US) using the DeepL API.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     text = "Text to translate"
 )
 async def translate(ctx, text: str):
     """Translates text to English (EN-US) using the DeepL API."""
-    tr_text = translator.translate_text(text, target_lang = "EN-US")
-    await ctx.response.send_message(f"{text} -> " + str(tr_text) + " (EN-US)")
+    tr_text = translation_cache.get(text, "EN-US")
+    if tr_text == None:
+        # Refuse rather than exceed the monthly DeepL character quota
+        if translation_cache.used() + len(text) > settings.deepl_char_limit:
+            await ctx.response.send_message(f"DeepL character quota for this month reached ({translation_cache.used()}/{settings.deepl_char_limit}). Translation unavailable until next month.", ephemeral = True)
+            return
+        await ctx.response.defer()
+        try:
+            tr_text = await translation_engine.translate(text, "EN-US")
+        except asyncio.TimeoutError:
+            await ctx.followup.send("Translation timed out. Please try again.", ephemeral = True)
+            return
+        except Exception as e:
+            await ctx.followup.send(f"Translation failed: {e}", ephemeral = True)
+            return
+        translation_cache.put(text, "EN-US", tr_text)
+        await ctx.followup.send(f"{text} -> " + tr_text + " (EN-US)")
+    else:
+        await ctx.response.send_message(f"{text} -> " + tr_text + " (EN-US)")
+    if translation_cache.used() >= settings.deepl_char_limit * settings.deepl_warn_ratio:
+        await ctx.followup.send(f"Warning: {translation_cache.used()}/{settings.deepl_char_limit} DeepL characters used this month.", ephemeral = True)
+
+# Translation stats command: shows cache hit rate and remaining DeepL budget
+@tree.command(
+        name = "translate_stats",
+        description = "Shows translation cache hit rate and remaining DeepL budget.",
+        guilds = guild_objects
+)
+@is_mod()
+async def translate_stats(ctx):
+    """Shows translation cache hit rate and remaining DeepL budget."""
+    lookups = translation_cache.hits + translation_cache.misses
+    hit_rate = 0 if lookups == 0 else translation_cache.hits / lookups
+    used = translation_cache.used()
+    embed = discord.Embed(title = "Translation Stats",
+                          color = yupil_color,
+                          timestamp = datetime.datetime.now())
+    embed.add_field(name = "Cache hit rate", value = f"{hit_rate:.1%} ({translation_cache.hits}/{lookups} since restart)")
+    embed.add_field(name = "Cached translations", value = f"{len(translation_cache.memory)} in memory, {translation_cache.stored()} on disk")
+    embed.add_field(name = "DeepL budget", value = f"{used}/{settings.deepl_char_limit} characters used, {max(settings.deepl_char_limit - used, 0)} remaining this month", inline = False)
+    lines = []
+    for channel_id in guild_settings[ctx.guild.id].auto_translate_channels:
+        stats = auto_translate_stats[channel_id]
+        lines.append(f"<#{channel_id}>: {stats['translated']} translated, {stats['english']} English, {stats['short']} too short, "
+                     f"{stats['characters_saved']} characters saved by the prefilter")
+    if len(lines) > 0:
+        embed.add_field(name = "Auto-translate (since restart)", value = "\n".join(lines)[:1024], inline = False)
+    await ctx.response.send_message(embed = embed, ephemeral = True)
+
+# Automatic inbound translation for configured channels, with a local language prefilter so English never reaches DeepL
+english_words = frozenset("""the be to of and a in that have i it for not on with he as you do at this but his by from they we
+say her she or an will my one all would there their what so up out if about who get which go me when make can like time
+no just him know take is are was were been has had im i'm dont don't it's its your you're how why thanks thank please yes
+hi hello hey lol ok okay guys anyone does did should could here now got want need think good new people some any
+than then them our us also only very really well where because going sure any still too""".split())
+
+other_words = {
+    "es": frozenset("""de la que el en y los se del las un por con una su para es al lo como más pero sus le ya o
+este sí porque esta entre cuando muy sin sobre también hasta hay donde quien desde todo nos hola gracias qué cómo
+bueno estoy tengo puedo alguien soy eres están pero""".split()),
+    "fr": frozenset("""le la les de des du un une et est en que qui dans pour pas sur ce il je tu vous nous avec ne se
+mais ou au aux son sa ses bonjour merci oui non c'est j'ai suis très quelqu'un est-ce salut""".split()),
+    "de": frozenset("""der die das und ist nicht ein eine ich du sie es wir mit auf für den dem von zu im auch aber wie
+was hallo danke bitte ja nein kann habe bin gibt jemand weiß""".split()),
+    "pt": frozenset("""de que não o a do da em um para é com uma os no se na por mais as dos como mas foi ao ele das
+tem à seu sua ou ser quando muito há nos já está eu também só olá obrigado obrigada você alguém""".split()),
+    "it": frozenset("""di che e il la per un non in una sono mi ho lo ma ci questo come è ti si del della anche ciao
+grazie perché qualcuno sei""".split()),
+    "nl": frozenset("""de het een en van ik te dat die in is niet je op met voor zijn er maar hallo bedankt wat hoe
+kan ook""".split()),
+    "id": frozenset("""yang dan di ini itu tidak saya aku apa ada dengan untuk bisa kamu ya juga sudah mau""".split()),
+    "tl": frozenset("""ang ng sa na mga ako ko mo hindi ikaw siya po ba lang yung""".split()),
+}
+
+def strip_markup(text: str):
+    """Removes code, links, mentions and custom emoji, which say nothing about the language"""
+    text = re.sub(r"```.*?```|`[^`]*`", " ", text, flags = re.DOTALL)
+    text = re.sub(r"https?://\S+", " ", text)
+    return re.sub(r"<(?:@[!&]?|#|a?:\w+:)\d+>", " ", text)
+
+def guess_language(text: str, min_letters: int):
+    """Returns "en", "other", or None for text too short to judge; undecided Latin-script text counts as English"""
+    text = strip_markup(text)
+    letters = [c for c in text if c.isalpha()]
+    if len(letters) == 0:
+        return None
+    non_latin = sum(1 for c in letters if not unicodedata.name(c, "").startswith("LATIN"))
+    if non_latin / len(letters) > 0.3:
+        # Syllabic and ideographic scripts pack more into each character
+        return "other" if len(letters) * 3 >= min_letters else None
+    if len(letters) < min_letters:
+        return None
+    words = re.findall(r"[^\W\d_]+(?:'[^\W\d_]+)?", text.lower())
+    english = sum(1 for word in words if word in english_words)
+    other = max(sum(1 for word in words if word in stopwords) for stopwords in other_words.values())
+    return "en" if english >= other else "other"
+
+auto_translate_stats = collections.defaultdict(collections.Counter)  # channel ID -> outcome counts and characters
+
+def count_auto_translate(channel_id: int, result: str, characters: int = 0):
+    stats = auto_translate_stats[channel_id]
+    stats[result] += 1
+    metrics.inc("yupil_auto_translate_messages_total", {"channel": channel_id, "result": result}, help = "Messages seen by auto-translate by channel and outcome")
+    if result == "english":
+        stats["characters_saved"] += characters
+        metrics.inc("yupil_auto_translate_characters_saved_total", {"channel": channel_id}, characters, "Characters kept from DeepL by the language prefilter")
+    elif result == "translated":
+        stats["characters_sent"] += characters
+
+async def auto_translate(message: discord.Message):
+    """Replies with an English translation of a non-English message"""
+    config = guild_settings[message.guild.id]
+    language = guess_language(message.content, config.auto_translate_min_letters)
+    if language == None:
+        count_auto_translate(message.channel.id, "short")
+        return
+    if language == "en":
+        count_auto_translate(message.channel.id, "english", len(message.content))
+        return
+    tr_text = translation_cache.get(message.content, "EN-US")
+    characters = 0
+    if tr_text == None:
+        if translation_cache.used() + len(message.content) > settings.deepl_char_limit:
+            count_auto_translate(message.channel.id, "quota")
+            return
+        try:
+            tr_text = await translation_engine.translate(message.content, "EN-US")
+        except Exception as e:
+            print(f"Auto-translate failed in {message.channel.id}: {e!r}")
+            count_auto_translate(message.channel.id, "failed")
+            return
+        translation_cache.put(message.content, "EN-US", tr_text)
+        characters = len(message.content)
+    # DeepL hands English back unchanged when the prefilter guessed wrong
+    if TranslationCache.normalize(tr_text).casefold() == TranslationCache.normalize(message.content).casefold():
+        count_auto_translate(message.channel.id, "unchanged")
+        return
+    await message.reply(f"-# 🌐 Translated to EN-US\n{tr_text}"[:2000], mention_author = False,
+                        allowed_mentions = discord.AllowedMentions.none())
+    count_auto_translate(message.channel.id, "translated", characters)
 
 # Define modal classes for interactive UI on button clicks
 class InfoModal(discord.ui.Modal):
@@ -353,27 +2228,30 @@ class InfoModal(discord.ui.Modal):
                                   required = True, min_length = 10)
     
     async def on_submit(ctx, interaction: discord.Interaction):
-        await interaction.response.send_message("Your ticket has been submitted. Thank you.", ephemeral = True)
-        # Create new ticket and set permissions
-        today = datetime.datetime.today()
-        ticket_name = f"{today.year}{'%02d' % today.month}{'%02d' % today.day}-{interaction.user.display_name}"
-        new_channel = await create_ticket(name = ticket_name.lower(), guild = interaction.guild)
-        mod_role = discord.utils.get(interaction.guild.roles, name = permitted_role)
-        mod_perms = new_channel.overwrites_for(mod_role)
-        mod_perms.read_messages = True
-        mod_perms.manage_messages = True
-        await new_channel.set_permissions(mod_role, overwrite = mod_perms)
-
-        # Send user input message and include close button
-        message_embed = discord.Embed(description = f"Ticket created by {interaction.user.mention}",
-                                      color = member_color)
-        user_avatar = None
-        if interaction.user.avatar != None:
-            user_avatar = interaction.user.avatar.url
-        message_embed.set_author(name = interaction.user.display_name,
-                                 icon_url = user_avatar)
-        message_embed.add_field(name = "Ticket message:", value = ctx.answer)
-        await new_channel.send(embed = message_embed, view = CloseButton(timeout = None))
+        if ticket_blocked(guild_id = interaction.guild_id, user_id = interaction.user.id, ticket_type = "info"):
+            await interaction.response.send_message("Your ticket is already being handled. Thank you.", ephemeral = True)
+            return
+        pending_tickets.add((interaction.guild_id, interaction.user.id))
+        try:
+            await interaction.response.send_message("Your ticket has been submitted. Thank you.", ephemeral = True)
+            # Create new ticket with mod team permissions; info tickets are not visible to their author
+            today = datetime.datetime.today()
+            ticket_name = f"{today.year}{'%02d' % today.month}{'%02d' % today.day}-{interaction.user.display_name}"
+            new_channel = await create_ticket(name = ticket_name.lower(), guild = interaction.guild, owner = interaction.user, ticket_type = "info", owner_access = False)
+
+            # Send user input message and include close button
+            message_embed = discord.Embed(description = f"Ticket created by {interaction.user.mention}",
+                                          color = member_color)
+            user_avatar = None
+            if interaction.user.avatar != None:
+                user_avatar = interaction.user.avatar.url
+            message_embed.set_author(name = interaction.user.display_name,
+                                     icon_url = user_avatar)
+            message_embed.add_field(name = "Ticket message:", value = ctx.answer)
+            await new_channel.send(embed = message_embed, view = CloseButton(timeout = None))
+            record_ticket_timing((discord.utils.utcnow() - interaction.created_at).total_seconds())
+        finally:
+            pending_tickets.discard((interaction.guild_id, interaction.user.id))
 
 class ModModal(discord.ui.Modal):
     answer = discord.ui.TextInput(label = "Please let us know how we can assist you.", 
@@ -382,36 +2260,35 @@ class ModModal(discord.ui.Modal):
                                   required = True, min_length = 10)
     
     async def on_submit(ctx, interaction: discord.Interaction):
-        await interaction.response.send_message("Submitting ticket.", ephemeral = True, delete_after = 2)
-        # Create new ticket and set permissions
-        today = datetime.datetime.today()
-        ticket_name = f"{today.year}{'%02d' % today.month}{'%02d' % today.day}-{interaction.user.display_name}"
-        new_channel = await create_ticket(name = ticket_name.lower(), guild = interaction.guild)
-        new_perms = new_channel.overwrites_for(interaction.user)
-        new_perms.read_messages = True
-        mod_role = discord.utils.get(interaction.guild.roles, name = permitted_role)
-        mod_perms = new_channel.overwrites_for(mod_role)
-        mod_perms.read_messages = True
-        mod_perms.manage_messages = True
-        await new_channel.set_permissions(interaction.user, overwrite = new_perms)
-        await new_channel.set_permissions(mod_role, overwrite = mod_perms)
-
-        # Send Yupil Bot and user message input embeds; include close button
-        mod_embed = discord.Embed(title = "Automated Message",
-                                  description = "A member of the Mod Team will respond when they're available. If you have other information to add to your ticket, such as screenshots or other images, feel free to send them now.\n\nThank you for your patience!",
-                                  color = yupil_color)
-        mod_embed.set_author(name = bot.user.display_name,
-                             icon_url = bot.user.avatar.url)
-        message_embed = discord.Embed(description = f"Ticket created by {interaction.user.mention}",
-                                      color = member_color)
-        user_avatar = None
-        if interaction.user.avatar != None:
-            user_avatar = interaction.user.avatar.url
-        message_embed.set_author(name = interaction.user.display_name,
-                                 icon_url = user_avatar)
-        message_embed.add_field(name = "Initial message:", value = ctx.answer)
-        await new_channel.send(f"Welcome, {interaction.user.mention}", embed = mod_embed, view = CloseButton(timeout = None))
-        await new_channel.send("\n", embed = message_embed)
+        if ticket_blocked(guild_id = interaction.guild_id, user_id = interaction.user.id, ticket_type = "mod"):
+            await interaction.response.send_message("You already have a ticket being set up. Please check your open tickets.", ephemeral = True)
+            return
+        pending_tickets.add((interaction.guild_id, interaction.user.id))
+        try:
+            await interaction.response.send_message("Submitting ticket.", ephemeral = True, delete_after = 2)
+            # Create new ticket with user and mod team permissions in a single call
+            today = datetime.datetime.today()
+            ticket_name = f"{today.year}{'%02d' % today.month}{'%02d' % today.day}-{interaction.user.display_name}"
+            new_channel = await create_ticket(name = ticket_name.lower(), guild = interaction.guild, owner = interaction.user, ticket_type = "mod")
+
+            # Send Yupil Bot and user message input embeds together, in order, with the close button
+            mod_embed = discord.Embed(title = "Automated Message",
+                                      description = "A member of the Mod Team will respond when they're available. If you have other information to add to your ticket, such as screenshots or other images, feel free to send them now.\n\nThank you for your patience!",
+                                      color = yupil_color)
+            mod_embed.set_author(name = bot.user.display_name,
+                                 icon_url = bot.user.avatar.url)
+            message_embed = discord.Embed(description = f"Ticket created by {interaction.user.mention}",
+                                          color = member_color)
+            user_avatar = None
+            if interaction.user.avatar != None:
+                user_avatar = interaction.user.avatar.url
+            message_embed.set_author(name = interaction.user.display_name,
+                                     icon_url = user_avatar)
+            message_embed.add_field(name = "Initial message:", value = ctx.answer)
+            await new_channel.send(f"Welcome, {interaction.user.mention}", embeds = [mod_embed, message_embed], view = CloseButton(timeout = None))
+            record_ticket_timing((discord.utils.utcnow() - interaction.created_at).total_seconds())
+        finally:
+            pending_tickets.discard((interaction.guild_id, interaction.user.id))
 
 # Define button classes for interactive buttons
 class Buttons(discord.ui.View):
@@ -434,20 +2311,21 @@ class Buttons(discord.ui.View):
 class FinishButtons(discord.ui.View):
     @discord.ui.button(label = "Delete Ticket (with transcript)",
                        style = discord.ButtonStyle.gray,
+                       custom_id = "finish01",
                        emoji = "✅")
     
     async def delete_transcript_button(self, interaction: discord.Interaction, button: discord.ui.Button): 
-        try:
-            await create_transcript(channel = interaction.channel)
-            await interaction.channel.delete()
-        except:
-            interaction.channel.send("Unable to save transcript.")
+        await interaction.response.send_message("Saving transcript. This ticket will be deleted once it is saved.")
+        job_queue.enqueue(guild_id = interaction.guild_id, kind = "ticket_transcript", serial_key = f"channel:{interaction.channel.id}",
+                          payload = {"channel_id": interaction.channel.id})
 
     @discord.ui.button(label = "Delete Ticket (no transcript)",
                        style = discord.ButtonStyle.gray,
+                       custom_id = "finish02",
                        emoji = "⛔")
     
     async def delete_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        ticket_registry.set_state(channel_id = interaction.channel.id, state = "deleted")
         await interaction.channel.delete()
 
 
@@ -455,23 +2333,32 @@ class FinishButtons(discord.ui.View):
 class CloseButton(discord.ui.View):
     @discord.ui.button(label = "Close Ticket",
                        style = discord.ButtonStyle.gray,
+                       custom_id = "close01",
                        emoji = "🔒")
     
     async def close_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         overwrites = interaction.channel.overwrites
-        mod_role = discord.utils.get(interaction.guild.roles, name = permitted_role)
+        mod_role = guild_settings[interaction.guild_id].mod_role
         await interaction.response.send_message("Closing ticket.", ephemeral = True, delete_after = 1)
-        for key in overwrites:
-            if key not in [mod_role, bot.user, interaction.guild.default_role]:
-                await interaction.channel.set_permissions(key, overwrite = None)
+        jobs = [(interaction.channel, key, None) for key in overwrites
+                if key not in [mod_role, interaction.guild.me, interaction.guild.default_role]]
+        results = await apply_overwrites(jobs)
         await interaction.message.edit(view = FinishButtons(timeout = None))
+        ticket_registry.set_state(channel_id = interaction.channel.id, state = "closed")
+        if any(result.status == "failed" for result in results):
+            embed = discord.Embed(title = "Ticket Closed",
+                                  description = f"Some members could not be removed from {interaction.channel.mention}.",
+                                  color = discord.Color.dark_gold(),
+                                  timestamp = datetime.datetime.now())
+            add_overwrite_summary(embed = embed, results = results)
+            await log_sinks[interaction.guild_id].send(embed = embed)
 
 @tree.command(
         name = "create_buttons",
         description = "Creates buttons for the ticket system.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 async def create_buttons(ctx):
     """Creates buttons for the ticket system."""
     await ctx.response.send_message("Creating buttons", ephemeral = True, delete_after = 1)
@@ -489,44 +2376,576 @@ async def create_buttons(ctx):
 @tree.command(
         name = "add_user",
         description = "Adds a user to a ticket.",
-        guild = discord.Object(id = server_id)
+        guilds = guild_objects
 )
-@ac.checks.has_role(permitted_role)
+@is_mod()
 @ac.describe(
     user = "User to add to a ticket",
     channel = "Ticket channel to add user to",
 )
 async def add_user(ctx, channel: discord.TextChannel, user: discord.User):
+    if ticket_registry.get(channel.id) == None:
+        # Tickets opened before the registry existed are only known by their helpdesk category; register them on first use
+        if channel.category_id != guild_settings[ctx.guild.id].helpdesk_channel_id:
+            await ctx.response.send_message(f"{channel.mention} is not a ticket channel.", ephemeral = True)
+            return
+        owner = next((target for target in channel.overwrites if isinstance(target, discord.Member) and target != ctx.guild.me), None)
+        ticket_registry.open(channel = channel, owner_id = owner.id if owner != None else None, ticket_type = "legacy")
     new_perms = channel.overwrites_for(user)
     new_perms.read_messages = True
     await channel.set_permissions(user, overwrite = new_perms)
     await ctx.response.send_message(f"{user.display_name} added to ticket.", ephemeral = True, delete_after = 1)
 
+# Tickets command: lists open and closed tickets from the registry
+@tree.command(
+        name = "tickets",
+        description = "Lists open tickets.",
+        guilds = guild_objects
+)
+@is_mod()
+async def tickets(ctx):
+    """Lists open tickets."""
+    rows = ticket_registry.active(guild_id = ctx.guild.id)
+    lines = [f"<#{row['channel_id']}> | {row['type']} | <@{row['owner_id']}> | {row['state']} | opened <t:{int(row['created_at'])}:R>" for row in rows]
+    description = "\n".join(lines) if len(lines) > 0 else "No open tickets."
+    if len(description) > 4000:
+        description = description[:4000] + "\n..."
+    embed = discord.Embed(title = f"Tickets ({len(rows)})",
+                          description = description,
+                          color = yupil_color)
+    if len(ticket_timings) > 0:
+        timings = sorted(ticket_timings)
+        embed.set_footer(text = f"Time to ticket: median {timings[len(timings) // 2]:.1f}s, max {timings[-1]:.1f}s over the last {len(timings)} tickets")
+    await ctx.response.send_message(embed = embed, ephemeral = True)
+
+# User history command: paginated timeline of a user's mod actions and logged events
+class HistoryPages(discord.ui.View):
+    """Previous/next pages through a user's history, usable only by the mod who asked for it"""
+    page_size = 10
+
+    def __init__(self, owner_id: int, guild_id: int, user: discord.User, action: str = None):
+        super().__init__(timeout = 300)
+        self.owner_id = owner_id
+        self.guild_id = guild_id
+        self.user = user
+        self.action = action
+        self.page = 0
+
+    def render(self):
+        total, rows = mod_history.timeline(guild_id = self.guild_id, user_id = self.user.id, action = self.action,
+                                           limit = self.page_size, offset = self.page * self.page_size)
+        pages = max(math.ceil(total / self.page_size), 1)
+        lines = []
+        for row in rows:
+            line = f"<t:{int(row['created_at'])}:f> **{row['action']}**"
+            if row["actor_id"] != None:
+                line += f" by <@{row['actor_id']}>"
+            if row["reference"] != None:
+                line += f" ([link]({row['reference']}))"
+            if row["detail"]:
+                line += "\n> " + row["detail"].replace("\n", " ")[:200]
+            lines.append(line)
+        embed = discord.Embed(title = f"History: {self.user}",
+                              description = "\n".join(lines) if len(lines) > 0 else "No history found.",
+                              color = yupil_color)
+        embed.set_footer(text = f"Page {self.page + 1}/{pages} | {total} entries" + (f" | {self.action} only" if self.action else "") + f" | ID: {self.user.id}")
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label = "Newer", style = discord.ButtonStyle.gray, emoji = "◀️")
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await interaction.response.edit_message(embed = self.render(), view = self)
+
+    @discord.ui.button(label = "Older", style = discord.ButtonStyle.gray, emoji = "▶️")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed = self.render(), view = self)
+
+history_choices = [ac.Choice(name = action, value = action) for action in ModHistory.actions]
+
+@tree.command(
+        name = "user_history",
+        description = "Shows a user's moderation history.",
+        guilds = guild_objects
+)
+@is_mod()
+@ac.describe(
+    user = "User to look up",
+    action = "Only show this kind of entry (default: all)"
+)
+@ac.choices(action = history_choices)
+async def user_history(ctx, user: discord.User, action: str = None):
+    """Shows a user's moderation history."""
+    view = HistoryPages(owner_id = ctx.user.id, guild_id = ctx.guild.id, user = user, action = action)
+    await ctx.response.send_message(embed = view.render(), view = view, ephemeral = True)
+
+# Export command: moderation history for a date range as JSONL or CSV
+@tree.command(
+        name = "export_history",
+        description = "Exports moderation history for a date range.",
+        guilds = guild_objects
+)
+@is_mod()
+@ac.describe(
+    start = "First day to include, as YYYY-MM-DD (UTC)",
+    end = "Last day to include, as YYYY-MM-DD (UTC, default: today)",
+    file_format = "File format (default: jsonl)",
+    user = "Only export this user (default: everyone)",
+    action = "Only export this kind of entry (default: all)"
+)
+@ac.choices(file_format = [ac.Choice(name = "jsonl", value = "jsonl"), ac.Choice(name = "csv", value = "csv")],
+            action = history_choices)
+async def export_history(ctx, start: str, end: str = None, file_format: str = "jsonl", user: discord.User = None, action: str = None):
+    """Exports moderation history for a date range."""
+    try:
+        start_date = datetime.date.fromisoformat(start)
+        end_date = datetime.date.fromisoformat(end) if end != None else datetime.datetime.now(datetime.timezone.utc).date()
+    except ValueError:
+        await ctx.response.send_message("Dates must be given as YYYY-MM-DD.", ephemeral = True)
+        return
+    await ctx.response.defer(ephemeral = True)
+    start_time = datetime.datetime.combine(start_date, datetime.time(), tzinfo = datetime.timezone.utc).timestamp()
+    end_time = datetime.datetime.combine(end_date + datetime.timedelta(days = 1), datetime.time(), tzinfo = datetime.timezone.utc).timestamp()
+    filename = f"history-{ctx.guild.id}-{start_date}-{end_date}.{file_format}.gz"
+    # Rows are compressed into a temporary file as they are read so large ranges are never held in memory
+    temp_fd, temp_path = tempfile.mkstemp(suffix = ".gz")
+    os.close(temp_fd)
+    try:
+        count = 0
+        with gzip.open(temp_path, "wt", encoding = "utf-8", newline = "") as output:
+            writer = csv.writer(output)
+            if file_format == "csv":
+                writer.writerow(ModHistory.columns + ("time",))
+            for row in mod_history.export(guild_id = ctx.guild.id, start = start_time, end = end_time,
+                                          user_id = user.id if user != None else None, action = action):
+                iso_time = datetime.datetime.fromtimestamp(row["created_at"], datetime.timezone.utc).isoformat()
+                if file_format == "csv":
+                    writer.writerow(tuple(row) + (iso_time,))
+                else:
+                    output.write(json.dumps({**dict(row), "time": iso_time}) + "\n")
+                count += 1
+        await ctx.followup.send(f"Exported {count} history entries from {start_date} to {end_date}.",
+                                file = discord.File(temp_path, filename = filename), ephemeral = True)
+    finally:
+        os.remove(temp_path)
+
+# Tiered message store so deletion and edit logs can show content beyond discord.py's message cache
+class StoredMessage:
+    """Compact record of a message: author ID, channel ID, content and attachment metadata only"""
+    __slots__ = ("message_id", "guild_id", "channel_id", "author_id", "created_at", "content", "attachments")
+
+    def __init__(self, message_id: int, guild_id: int, channel_id: int, author_id: int, created_at: float, content: str, attachments: list):
+        self.message_id = message_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.created_at = created_at
+        self.content = content
+        self.attachments = attachments  # list of (filename, content_type, size, url)
+
+    @property
+    def jump_url(self):
+        return f"https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.message_id}"
+
+    def size(self):
+        """Approximate memory footprint in bytes"""
+        return 200 + len(self.content.encode()) + sum(100 + len(filename) + len(url) for filename, content_type, size, url in self.attachments)
+
+class MessageStore:
+    """Hot in-memory tier with a byte budget, spilling evicted messages to an indexed SQLite cold tier"""
+    def __init__(self, path: str, memory_budget: int, retention_days: int, max_rows: int):
+        self.hot = collections.OrderedDict()
+        self.hot_bytes = 0
+        self.memory_budget = memory_budget
+        self.retention = retention_days * 86400
+        self.max_rows = max_rows
+        self.evicted = []  # evicted records waiting to be written to the cold tier in one batch
+        self.removed = set()  # deleted message IDs waiting to be removed from the cold tier in one batch
+        self.writes = 0
+        self.db = sqlite3.connect(path)
+        # WAL with normal sync keeps each batch write from waiting on a disk sync
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS messages (message_id INTEGER PRIMARY KEY, guild_id INTEGER, channel_id INTEGER, author_id INTEGER, created_at REAL, content TEXT, attachments TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_created ON messages (created_at)")
+        self.db.commit()
+
+    def add(self, message: discord.Message):
+        """Stores a new or edited message in the hot tier"""
+        attachments = [(a.filename, a.content_type, a.size, a.url) for a in message.attachments]
+        self.put(StoredMessage(message.id, message.guild.id, message.channel.id, message.author.id,
+                               message.created_at.timestamp(), message.content, attachments))
+
+    def put(self, record: StoredMessage):
+        if record.message_id in self.hot:
+            self.hot_bytes -= self.hot.pop(record.message_id).size()
+        self.hot[record.message_id] = record
+        self.hot_bytes += record.size()
+        while self.hot_bytes > self.memory_budget and len(self.hot) > 0:
+            message_id, evicted = self.hot.popitem(last = False)
+            self.hot_bytes -= evicted.size()
+            self.evicted.append(evicted)
+        if len(self.evicted) >= 100:
+            self.flush()
+
+    def get(self, message_id: int):
+        """Returns the stored message from the hot or cold tier, or None"""
+        if message_id in self.hot:
+            return self.hot[message_id]
+        if message_id in self.removed:
+            return None
+        for record in self.evicted:
+            if record.message_id == message_id:
+                return record
+        row = self.db.execute("SELECT * FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        if row == None:
+            return None
+        return StoredMessage(*row[:6], [tuple(a) for a in json.loads(row[6])])
+
+    def update_content(self, message_id: int, content: str):
+        """Records the new content of an edited message"""
+        record = self.get(message_id)
+        if record != None:
+            self.put(StoredMessage(record.message_id, record.guild_id, record.channel_id, record.author_id,
+                                   record.created_at, content, record.attachments))
+
+    def remove(self, message_id: int):
+        """Forgets a deleted message in both tiers; the cold tier delete is batched with the next flush"""
+        if message_id in self.hot:
+            self.hot_bytes -= self.hot.pop(message_id).size()
+        self.evicted = [record for record in self.evicted if record.message_id != message_id]
+        self.removed.add(message_id)
+        if len(self.removed) >= 100:
+            self.flush()
+
+    def remove_many(self, message_ids: list):
+        """Forgets many deleted messages in one write"""
+        message_ids = set(message_ids)
+        for message_id in message_ids & self.hot.keys():
+            self.hot_bytes -= self.hot.pop(message_id).size()
+        self.evicted = [record for record in self.evicted if record.message_id not in message_ids]
+        self.db.executemany("DELETE FROM messages WHERE message_id = ?", [(message_id,) for message_id in message_ids])
+        self.db.commit()
+
+    def persist(self):
+        """Writes the hot tier to the cold tier as well, so nothing is lost on shutdown"""
+        self.evicted += list(self.hot.values())
+        self.flush()
+
+    def flush(self):
+        """Writes evicted records to the cold tier and applies retention by age and row count"""
+        self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            [(r.message_id, r.guild_id, r.channel_id, r.author_id, r.created_at, r.content, json.dumps(r.attachments)) for r in self.evicted])
+        self.writes += len(self.evicted)
+        self.evicted = []
+        self.db.executemany("DELETE FROM messages WHERE message_id = ?", [(message_id,) for message_id in self.removed])
+        self.removed = set()
+        # Retention is only checked every few thousand writes to keep evictions cheap
+        if self.writes >= 5000:
+            self.writes = 0
+            self.db.execute("DELETE FROM messages WHERE created_at < ?", (time.time() - self.retention,))
+            overflow = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] - self.max_rows
+            if overflow > 0:
+                self.db.execute("DELETE FROM messages WHERE message_id IN (SELECT message_id FROM messages ORDER BY created_at LIMIT ?)", (overflow,))
+        self.db.commit()
+
+message_store = MessageStore(path = settings.message_store_db,
+                             memory_budget = settings.message_store_memory_mb * 1024 * 1024,
+                             retention_days = settings.message_store_retention_days,
+                             max_rows = settings.message_store_max_rows)
+
+# Content-addressed local capture of attachments, so deletion logs do not depend on expiring CDN URLs
+logged_content_types = ("image/png", "image/jpeg", "image/webp", "image/gif", "video/mov", "video/mp4", "video/mpeg", "audio/mpeg", "audio/wav")
+
+class AttachmentStore:
+    """Streams attachments to hash-named files on disk with dedup, a per-file size cap and LRU/age eviction under a disk budget"""
+    def __init__(self, directory: str, max_file_size: int, disk_budget: int, max_age_days: int):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.disk_budget = disk_budget
+        self.max_age = max_age_days * 86400
+        self.session = None
+        self.tasks = set()  # background captures, referenced so they are not garbage collected
+        os.makedirs(directory, exist_ok = True)
+        self.db = sqlite3.connect(os.path.join(directory, "index.db"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS attachments (attachment_id INTEGER PRIMARY KEY, message_id INTEGER, sha256 TEXT, filename TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message_id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER, created_at REAL, last_access REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)")
+        self.db.commit()
+
+    def path(self, sha256: str):
+        return os.path.join(self.directory, sha256)
+
+    def capture_later(self, message: discord.Message):
+        """Captures a message's attachments in the background"""
+        task = asyncio.create_task(self.capture(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def capture(self, message: discord.Message):
+        """Streams each allowed attachment of a message to disk"""
+        for attachment in message.attachments:
+            if attachment.content_type not in logged_content_types or attachment.size > self.max_file_size:
+                continue
+            try:
+                sha256 = await self._download(attachment)
+            except Exception as e:
+                print(f"Failed to capture attachment {attachment.filename}: {e}")
+                continue
+            if sha256 != None:
+                self.db.execute("INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?)", (attachment.id, message.id, sha256, attachment.filename))
+                self.db.commit()
+        self.evict()
+
+    async def _download(self, attachment: discord.Attachment):
+        if self.session == None:
+            self.session = aiohttp.ClientSession()
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = self.path(f"{attachment.id}.part")
+        async with self.session.get(attachment.url) as response:
+            response.raise_for_status()
+            with open(temp_path, "wb") as temp_file:
+                async for chunk in response.content.iter_chunked(65536):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        break
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+        if size > self.max_file_size:
+            os.remove(temp_path)
+            return None
+        sha256 = digest.hexdigest()
+        now = time.time()
+        # Identical content is only kept once
+        if os.path.isfile(self.path(sha256)):
+            os.remove(temp_path)
+            self.db.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (now, sha256))
+        else:
+            os.replace(temp_path, self.path(sha256))
+        self.db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)", (sha256, size, now, now))
+        return sha256
+
+    def files_for(self, message_id: int):
+        """Returns {attachment_id: (filename, path)} for the captured attachments of a message"""
+        rows = self.db.execute("SELECT attachment_id, sha256, filename FROM attachments WHERE message_id = ?", (message_id,)).fetchall()
+        files = {}
+        for attachment_id, sha256, filename in rows:
+            if os.path.isfile(self.path(sha256)):
+                files[attachment_id] = (filename, self.path(sha256))
+                self.db.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+        self.db.commit()
+        return files
+
+    def evict(self):
+        """Removes files older than the maximum age, then least recently used files until under the disk budget"""
+        expired = self.db.execute("SELECT sha256 FROM blobs WHERE created_at < ?", (time.time() - self.max_age,)).fetchall()
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        victims = [row[0] for row in expired]
+        if total > self.disk_budget:
+            for sha256, size in self.db.execute("SELECT sha256, size FROM blobs ORDER BY last_access"):
+                if total <= self.disk_budget:
+                    break
+                total -= size
+                victims.append(sha256)
+        for sha256 in set(victims):
+            if os.path.isfile(self.path(sha256)):
+                os.remove(self.path(sha256))
+            self.db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self.db.execute("DELETE FROM attachments WHERE sha256 = ?", (sha256,))
+        self.db.commit()
+
+# Capture is decided at startup; changing it needs a restart
+attachment_capture = settings.attachment_capture
+attachment_store = None
+if attachment_capture:
+    attachment_store = AttachmentStore(directory = settings.attachment_dir,
+                                       max_file_size = settings.attachment_max_mb * 1024 * 1024,
+                                       disk_budget = settings.attachment_budget_mb * 1024 * 1024,
+                                       max_age_days = settings.attachment_max_age_days)
+
 # Listen for new message events
 @bot.event
+@timed
 async def on_message(message: discord.Message):
     if message.author.bot:
         return
-    elif message.channel.id == welcome_channel:
+    if message.guild != None:
+        if message.guild.id not in guild_settings:
+            return
+        message_store.add(message)
+        if attachment_capture and len(message.attachments) > 0:
+            attachment_store.capture_later(message)
+    if message.guild != None and message.channel.id == guild_settings[message.guild.id].welcome_channel_id:
         await remove_duplicate_welcomes(message = message)
+    elif message.guild != None and message.channel.id in guild_settings[message.guild.id].auto_translate_channels:
+        await auto_translate(message = message)
     elif isinstance(message.channel, discord.DMChannel):
+        if attachment_capture and len(message.attachments) > 0:
+            await attachment_store.capture(message)
         await log_dm_reply(message = message)
     else:
         return
 
 # Remove duplicate welcome messages
+class RecentAuthorIndex:
+    """Sliding time/size window of the latest welcome message per author, giving O(1) duplicate checks without history reads"""
+    def __init__(self, window_seconds: float, max_messages: int):
+        self.window_seconds = window_seconds
+        self.max_messages = max_messages
+        self.order = collections.deque()  # (timestamp, author_id, message_id), oldest first
+        self.latest = {}  # author_id -> message_id of their latest message in the window
+
+    def add(self, author_id: int, message_id: int):
+        """Records a message and returns the ID of the author's previous message in the window, or None"""
+        now = time.monotonic()
+        while len(self.order) > 0 and (self.order[0][0] < now - self.window_seconds or len(self.order) >= self.max_messages):
+            timestamp, old_author_id, old_message_id = self.order.popleft()
+            if self.latest.get(old_author_id) == old_message_id:
+                del self.latest[old_author_id]
+        previous = self.latest.get(author_id)
+        self.latest[author_id] = message_id
+        self.order.append((now, author_id, message_id))
+        return previous
+
+welcome_indexes = {guild_id: RecentAuthorIndex(window_seconds = config.welcome_window_seconds,
+                                                max_messages = config.welcome_window_size) for guild_id, config in guild_settings.items()}
+welcome_deletions = {}  # welcome channel ID -> duplicate message IDs waiting for the next bulk delete
+welcome_flushes = {}  # welcome channel ID -> scheduled bulk delete task
+
+async def flush_welcome_deletions(channel: discord.TextChannel):
+    """Bulk deletes the duplicates collected over a short interval"""
+    await asyncio.sleep(1)
+    pending = welcome_deletions[channel.id]
+    while len(pending) > 0:
+        batch = pending[:100]
+        del pending[:100]
+        try:
+            await channel.delete_messages([discord.Object(id = message_id) for message_id in batch])
+        except discord.HTTPException as e:
+            print(f"Failed to remove {len(batch)} duplicate welcome messages: {e}")
+    del welcome_flushes[channel.id]
+
 async def remove_duplicate_welcomes(message: discord.Message):
     if "just boosted the server!" in message.content:
         return
-    else:
-        async for m in message.channel.history(limit = 5):
-            if m.author == message.author and m.id != message.id and ("just boosted the server!" not in m.content):
-                await m.delete()
+    previous = welcome_indexes[message.guild.id].add(author_id = message.author.id, message_id = message.id)
+    if previous != None:
+        welcome_deletions.setdefault(message.channel.id, []).append(previous)
+        if message.channel.id not in welcome_flushes:
+            welcome_flushes[message.channel.id] = asyncio.create_task(flush_welcome_deletions(channel = message.channel))
+
+# Join flood detection: a sliding window of joins with cheap per-account signals, quarantining suspects during a flood
+raid_signal_names = ("new account", "default avatar", "similar name")
+
+def name_skeleton(name: str):
+    """Folds a name to lowercase letters without accents, digits, separators or repeats, so bot name patterns collide"""
+    letters = [c for c in unicodedata.normalize("NFKD", name.casefold()) if c.isalpha()]
+    return "".join(c for i, c in enumerate(letters) if i == 0 or c != letters[i - 1])
+
+class JoinFloodDetector:
+    """Sliding time window of recent joins for one guild; each join costs O(1) amortized"""
+    def __init__(self, max_joins: int = 10000):
+        self.max_joins = max_joins
+        self.order = collections.deque()  # (timestamp, member, name skeleton, signal flags), oldest first
+        self.skeletons = collections.Counter()  # name skeleton -> joins in the window
+        self.flood_until = 0.0  # monotonic time the current flood ends unless more joins arrive
+
+    def signals(self, member: discord.Member, skeleton: str, flags: int):
+        """Returns the names of the signals an account shows, counting names shared by 3 or more joins in the window"""
+        if len(skeleton) > 0 and self.skeletons[skeleton] >= 3:
+            flags |= 4
+        return [name for bit, name in enumerate(raid_signal_names) if flags & (1 << bit)]
+
+    def add(self, member: discord.Member, config: Settings):
+        """Records a join and returns (member, signals) to quarantine: the window's suspects when a flood starts, then each suspect joining during it"""
+        now = time.monotonic()
+        while len(self.order) > 0 and (self.order[0][0] < now - config.raid_window_seconds or len(self.order) >= self.max_joins):
+            timestamp, old_member, old_skeleton, old_flags = self.order.popleft()
+            self.skeletons[old_skeleton] -= 1
+            if self.skeletons[old_skeleton] <= 0:
+                del self.skeletons[old_skeleton]
+        flags = 0
+        if time.time() - member.created_at.timestamp() < config.raid_account_age_days * 86400:
+            flags |= 1
+        if member.avatar == None:
+            flags |= 2
+        skeleton = name_skeleton(member.global_name or member.name)
+        self.skeletons[skeleton] += 1
+        self.order.append((now, member, skeleton, flags))
+        if len(self.order) < config.raid_join_threshold:
+            return []
+        flooding = now < self.flood_until
+        self.flood_until = now + config.raid_window_seconds
+        # A new flood sweeps the whole window once; after that only the joining member is checked
+        entries = [self.order[-1]] if flooding else list(self.order)
+        suspects = [(entry[1], self.signals(entry[1], entry[2], entry[3])) for entry in entries]
+        return [(suspect, signals) for suspect, signals in suspects if len(signals) >= config.raid_min_signals]
+
+join_detectors = {guild_id: JoinFloodDetector() for guild_id in guild_ids}
+raid_suspects = {}  # guild ID -> {member ID: (member, signals)} waiting for the next quarantine pass
+raid_flushes = {}  # guild ID -> scheduled quarantine task
+
+async def flush_raid_suspects(guild: discord.Guild):
+    """Quarantines (or only reports, with raid_action = alert) the suspects collected over a short interval in one pass"""
+    await asyncio.sleep(2)
+    config = guild_settings[guild.id]
+    suspects = raid_suspects.pop(guild.id)
+    del raid_flushes[guild.id]
+    members = [member for member, signals in suspects.values() if not member.bot and config.mod_role not in member.roles]
+    if len(members) == 0:
+        return
+    overwrite_results = []
+    failed_roles = []
+    if config.raid_action == "quarantine":
+        if config.restrict_mode == "role":
+            failed_roles = await members_role_on(members = members, role = await get_restricted_role(guild), reason = "Join flood quarantine by YupilBot")
+        else:
+            overwrite_results = await members_channels_off(members = members, guild = guild)
+        failed_ids = {member.id for member, error in failed_roles}
+        quarantined = [member for member in members if member.id not in failed_ids]
+        mod_history.record_many([(guild.id, member.id, "restrict", None, "Join flood quarantine", None) for member in quarantined])
+        metrics.inc("yupil_raid_quarantined_total", value = len(quarantined), help = "Members quarantined by join flood detection")
+    lines = "\n".join(f"{member.mention}: {', '.join(suspects[member.id][1]) or 'joined during flood'}" for member in members)
+    if len(lines) > 4000:
+        lines = lines[:4000] + "\n..."
+    log_embed = discord.Embed(title = "Join Flood: Quarantined" if config.raid_action == "quarantine" else "Join Flood Detected",
+                              description = f"{len(members)} suspicious joins ({len(join_detectors[guild.id].order)} joins in the last {config.raid_window_seconds:g}s).\n{lines}",
+                              color = discord.Color.red(),
+                              timestamp = datetime.datetime.now())
+    if len(overwrite_results) > 0:
+        add_overwrite_summary(embed = log_embed, results = overwrite_results)
+    add_role_failures(embed = log_embed, failures = failed_roles)
+    await log_sinks[guild.id].send(embed = log_embed)
+
+# Listen for member joins
+@bot.event
+@timed
+async def on_member_join(member: discord.Member):
+    config = guild_settings.get(member.guild.id)
+    if config == None or config.raid_join_threshold == 0:
+        return
+    suspects = join_detectors[member.guild.id].add(member = member, config = config)
+    metrics.inc("yupil_member_joins_total", {"result": "suspect" if any(suspect == member for suspect, signals in suspects) else "allowed"},
+                help = "Member joins by join flood verdict")
+    if len(suspects) == 0:
+        return
+    pending = raid_suspects.setdefault(member.guild.id, {})
+    for suspect, signals in suspects:
+        pending[suspect.id] = (suspect, signals)
+    if member.guild.id not in raid_flushes:
+        raid_flushes[member.guild.id] = asyncio.create_task(flush_raid_suspects(guild = member.guild))
 
 # Log DM replies
 async def log_dm_reply(message: discord.Message):
     timestamp = datetime.datetime.now()
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
     embed = discord.Embed(title = "DM Reply",
                           description = f"**Received DM reply from {message.author.mention}**\n{message.content}",
                           color = member_color,
@@ -539,30 +2958,40 @@ async def log_dm_reply(message: discord.Message):
         embed.set_author(name = message.author)
     embed.set_footer(text = f"Author: {message.author} | ID: {message.author.id}")
 
-    attach = []
-    for attachment in message.attachments:
-        try: 
-            attach.append(await attachment.to_file(use_cached = True))
-        except:
-            embed.add_field(name = "Attachment unable to be sent", value = attachment.filename)
+    # Log the reply in every configured guild the author shares with the bot
+    local_files = attachment_store.files_for(message.id) if attachment_capture else {}
+    for sink in log_sinks_for(guild_id = None, user_id = message.author.id):
+        guild_embed = embed.copy()
+        attach = []
+        for attachment in message.attachments:
+            try: 
+                if attachment.id in local_files:
+                    attach.append(discord.File(local_files[attachment.id][1], filename = attachment.filename))
+                else:
+                    attach.append(await attachment.to_file(use_cached = True))
+            except:
+                guild_embed.add_field(name = "Attachment unable to be sent", value = attachment.filename)
 
-    if len(attach) == 0:
-        await log_channel.send(embed = embed)
-    else:
-        embed.add_field(name = "Files included", value = "See attachment(s) below")
-        await log_channel.send(embed = embed)
-        await log_channel.send(files = attach)
+        if len(attach) > 0:
+            guild_embed.add_field(name = "Files included", value = "See attachment(s) below")
+        await sink.send(embed = guild_embed, files = attach)
+        mod_history.record(guild_id = sink.guild_id, user_id = message.author.id, action = "dm_reply", detail = message.content, reference = message.jump_url)
 
 # Log message deletions
 @bot.event
+@timed
 async def on_raw_message_delete(message: discord.RawMessageDeleteEvent):
     timestamp = datetime.datetime.now()
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
+    sinks = log_sinks_for(guild_id = message.guild_id, user_id = message.cached_message.author.id if message.cached_message else None)
+    if len(sinks) == 0:
+        return
     attach = []
+    author_id = None
     try:
         if message.cached_message:
             if message.cached_message.author.bot:
                 return
+            author_id, content = message.cached_message.author.id, message.cached_message.content
             user_link = message.cached_message.author.mention
             embedVar = discord.Embed(title = None,
                                          description = f"**Message sent by {user_link} deleted in {message.cached_message.jump_url}**\n{message.cached_message.content}",
@@ -577,10 +3006,14 @@ async def on_raw_message_delete(message: discord.RawMessageDeleteEvent):
 
             i = 1
             num_attachments = len(message.cached_message.attachments)
+            local_files = attachment_store.files_for(message.message_id) if attachment_capture else {}
             for attachment in message.cached_message.attachments:
-                if attachment.content_type in ("image/png", "image/jpeg", "image/webp", "image/gif", "video/mov", "video/mp4", "video/mpeg", "audio/mpeg", "audio/wav"):
+                if attachment.content_type in logged_content_types:
                     try:
-                        attach.append(await attachment.to_file(use_cached=True))
+                        if attachment.id in local_files:
+                            attach.append(discord.File(local_files[attachment.id][1], filename = attachment.filename))
+                        else:
+                            attach.append(await attachment.to_file(use_cached=True))
                     except BaseException as failure:
                         note = f"Unable to save attachment of type `{attachment.content_type}`, filename: **{attachment.filename}**"
                         embedVar.add_field(name = f"Attachment {i}/{num_attachments}:", value = note, inline = False)
@@ -589,21 +3022,44 @@ async def on_raw_message_delete(message: discord.RawMessageDeleteEvent):
                     embedVar.add_field(name = f"Attachment {i}/{num_attachments}:", value = note, inline = False)
                 i += 1
 
+        elif message_store.get(message.message_id) != None:
+            stored = message_store.get(message.message_id)
+            author_id, content = stored.author_id, stored.content
+            embedVar = discord.Embed(title = None,
+                                         description = f"**Message sent by <@{stored.author_id}> deleted in {stored.jump_url}**\n{stored.content}",
+                                         color = deletion_color,
+                                         timestamp = timestamp)
+            embedVar.set_footer(text = f"Author ID: {stored.author_id} | Message ID: {stored.message_id}")
+            i = 1
+            local_files = {filename: path for filename, path in attachment_store.files_for(message.message_id).values()} if attachment_capture else {}
+            for filename, content_type, size, url in stored.attachments:
+                if filename in local_files:
+                    attach.append(discord.File(local_files[filename], filename = filename))
+                else:
+                    note = f"Attachment of type `{content_type}` no longer available, filename: **{filename}**"
+                    embedVar.add_field(name = f"Attachment {i}/{len(stored.attachments)}:", value = note, inline = False)
+                i += 1
+
         else:
             note = "Message not cached, unable to display content."
-            channel = bot.get_channel(message.channel_id)
+            # Threads and forum posts are not returned by Guild.get_channel
+            channel = bot.get_guild(message.guild_id).get_channel_or_thread(message.channel_id)
+            channel_url = channel.jump_url if channel != None else f"https://discord.com/channels/{message.guild_id}/{message.channel_id}"
             embedVar = discord.Embed(title = None,
-                                         description = f"**Uncached message deleted in {channel.jump_url}**\n{note}",
+                                         description = f"**Uncached message deleted in {channel_url}**\n{note}",
                                          color = deletion_color,
                                          timestamp = timestamp)
             embedVar.set_footer(text = f"Message ID: {message.message_id}")
 
-        if len(attach) == 0:
-            await log_channel.send(embed = embedVar)
-        else:
+        if len(attach) > 0:
             embedVar.add_field(name = "Files included", value = "See attachment(s) below")
-            await log_channel.send(embed = embedVar)
-            await log_channel.send(files = attach)
+        # Files can only be uploaded once, so a DM deletion logged in several guilds carries them in the first
+        for i, sink in enumerate(sinks):
+            await sink.send(embed = embedVar, files = attach if i == 0 else [])
+        if author_id != None:
+            jump_url = f"https://discord.com/channels/{message.guild_id or '@me'}/{message.channel_id}/{message.message_id}"
+            mod_history.record_many([(sink.guild_id, author_id, "message_delete", None, content, jump_url) for sink in sinks])
+        message_store.remove(message.message_id)
     except BaseException as e:
         note = "**Error occurred when logging deleted message**\n"
         embedVar = discord.Embed(title=None,
@@ -611,43 +3067,119 @@ async def on_raw_message_delete(message: discord.RawMessageDeleteEvent):
                                  color=discord.Color.dark_gold(),
                                  timestamp= timestamp
         )
-        await log_channel.send(embed=embedVar)
+        for sink in sinks:
+            await sink.send(embed=embedVar)
+
+# Log bulk message deletions (purges) as one summarized entry
+@bot.event
+@timed
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    timestamp = datetime.datetime.now()
+    if payload.guild_id not in log_sinks:
+        return
+    # Threads and forum posts are not returned by Guild.get_channel
+    channel = bot.get_guild(payload.guild_id).get_channel_or_thread(payload.channel_id)
+    channel_url = channel.jump_url if channel != None else f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}"
+    cached = {m.id: m for m in payload.cached_messages}
+    authors = collections.Counter()
+    uncached = 0
+    lines = []
+    history = []
+    for message_id in sorted(payload.message_ids):
+        if message_id in cached:
+            author_id, content = cached[message_id].author.id, cached[message_id].content
+            if cached[message_id].author.bot:
+                continue
+        elif message_store.get(message_id) != None:
+            author_id, content = message_store.get(message_id).author_id, message_store.get(message_id).content
+        else:
+            uncached += 1
+            continue
+        authors[author_id] += 1
+        lines.append(f"[{discord.utils.snowflake_time(message_id).isoformat()}] {author_id}: {content}")
+        history.append((payload.guild_id, author_id, "message_delete", None, content,
+                        f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{message_id}"))
+    message_store.remove_many(payload.message_ids)
+    mod_history.record_many(history)
+
+    embedVar = discord.Embed(title = None,
+                             description = f"**{len(payload.message_ids)} messages bulk deleted in {channel_url}**",
+                             color = deletion_color,
+                             timestamp = timestamp)
+    if len(authors) > 0:
+        author_counts = "\n".join(f"<@{author_id}>: {count}" for author_id, count in authors.most_common(20))
+        embedVar.add_field(name = "Authors", value = author_counts, inline = False)
+    embedVar.add_field(name = "Uncached", value = str(uncached))
+    files = []
+    if len(lines) > 0:
+        files.append(discord.File(io.BytesIO("\n".join(lines).encode()), filename = f"purge-{payload.channel_id}.txt"))
+        embedVar.add_field(name = "Files included", value = "See attachment(s) below")
+    await log_sinks[payload.guild_id].send(embed = embedVar, files = files)
 
 # Log message edits
+def avatar_url(user_data: dict):
+    """Builds an avatar URL from a raw user payload, or None for default avatars"""
+    if user_data.get("avatar") == None:
+        return None
+    return f"https://cdn.discordapp.com/avatars/{user_data['id']}/{user_data['avatar']}.png"
+
 @bot.event
+@timed
 async def on_raw_message_edit(message: discord.RawMessageUpdateEvent):
     timestamp = datetime.datetime.now()
-    log_channel = bot.get_channel(int(config[os.getenv('YUPIL_ENV')]['log_channel']))
+    if message.guild_id != None and message.guild_id not in log_sinks:
+        return
+    sinks = []
     try:
+        # Build the "after" state from the gateway payload, only falling back to REST when it is partial
+        if "content" in message.data and "author" in message.data:
+            metrics.inc("yupil_edit_log_total", {"source": "payload"}, help = "Edit logs built from the gateway payload or a REST fallback")
+            after = message.data["content"]
+            author_data = message.data["author"]
+        else:
+            metrics.inc("yupil_edit_log_total", {"source": "fallback"}, help = "Edit logs built from the gateway payload or a REST fallback")
+            message_channel = bot.get_channel(message.channel_id) or await bot.fetch_channel(message.channel_id)
+            new_message = await message_channel.fetch_message(message.message_id)
+            after = new_message.content
+            author_data = {"id": new_message.author.id, "username": str(new_message.author), "bot": new_message.author.bot,
+                           "avatar": new_message.author.avatar.key if new_message.author.avatar else None}
+        if author_data.get("bot", False):
+            return
+        sinks = log_sinks_for(guild_id = message.guild_id, user_id = int(author_data["id"]))
+
+        stored = message_store.get(message.message_id)
         if message.cached_message:
-            new_message = await bot.get_channel(message.channel_id).fetch_message(message.data.get('id'))
             before = message.cached_message.content
-            after = new_message.content
-            if before == after or message.cached_message.author.bot:
-                return
-            user_link = message.cached_message.author.mention
-            embedVar = discord.Embed(title = None,
-                                         description = f"**Message sent by {user_link} edited in {message.cached_message.jump_url}**",
-                                         color = edit_color,
-                                         timestamp = timestamp)
-            if message.cached_message.author.avatar:
-                embedVar.set_author(name = message.cached_message.author,
-                                        icon_url = message.cached_message.author.avatar.url)
-            embedVar.set_footer(text = f"Author: {message.cached_message.author} | ID: {message.cached_message.author.id}")
-            embedVar.add_field(name = "Before:", value = before, inline = False)
-            embedVar.add_field(name = "After:", value = after, inline = False)
+        elif stored != None:
+            before = stored.content
         else:
-            message_channel = await bot.fetch_channel(message.channel_id)
-            message = await message_channel.fetch_message(message.message_id)
-            embedVar = discord.Embed(title = None,
-                                     description = f"**Message sent by {message.author.mention} edited in {message.jump_url}**",
-                                     color = edit_color,
-                                     timestamp = timestamp)
-            embedVar.set_footer(text = f"Author: {message.author} | ID: {message.author.id}")
-            embedVar.add_field(name = "Before:", value = "`Message uncached`", inline = False)
-            embedVar.add_field(name = "After:", value = message.content, inline = False)
-
-        await log_channel.send(embed = embedVar)
+            before = None
+        if before == after:
+            return
+        message_store.update_content(message.message_id, after)
+
+        jump_url = f"https://discord.com/channels/{message.guild_id or '@me'}/{message.channel_id}/{message.message_id}"
+        embedVar = discord.Embed(title = None,
+                                 description = f"**Message sent by <@{author_data['id']}> edited in {jump_url}**",
+                                 color = edit_color,
+                                 timestamp = timestamp)
+        if message.cached_message:
+            author = message.cached_message.author
+            if author.avatar:
+                embedVar.set_author(name = author,
+                                    icon_url = author.avatar.url)
+            embedVar.set_footer(text = f"Author: {author} | ID: {author.id}")
+        else:
+            if avatar_url(author_data):
+                embedVar.set_author(name = author_data.get("username"),
+                                    icon_url = avatar_url(author_data))
+            embedVar.set_footer(text = f"Author: {author_data.get('username')} | ID: {author_data['id']}")
+        embedVar.add_field(name = "Before:", value = "`Message uncached`" if before == None else before, inline = False)
+        embedVar.add_field(name = "After:", value = after, inline = False)
+
+        for sink in sinks:
+            await sink.send(embed = embedVar)
+        mod_history.record_many([(sink.guild_id, int(author_data["id"]), "message_edit", None, f"{before}\n->\n{after}" if before != None else after, jump_url) for sink in sinks])
     except BaseException as e:
         note = "**Error occurred when logging edited message**\n"
         embedVar = discord.Embed(title=None,
@@ -655,19 +3187,133 @@ async def on_raw_message_edit(message: discord.RawMessageUpdateEvent):
                                  color=discord.Color.dark_gold(),
                                  timestamp= timestamp
         )
-        await log_channel.send(embed=embedVar)
+        for sink in sinks or log_sinks_for(guild_id = message.guild_id):
+            await sink.send(embed=embedVar)
+
+
+# Gauges read at scrape time
+metrics.gauge("yupil_gateway_latency_seconds", lambda: bot.latency, "Gateway heartbeat latency")
+metrics.gauge("yupil_message_cache_messages", lambda: len(bot.cached_messages), "Messages held in discord.py's message cache")
+metrics.gauge("yupil_message_cache_capacity", lambda: message_cache_size, "Capacity of discord.py's message cache")
+metrics.gauge("yupil_message_store_hot_bytes", lambda: message_store.hot_bytes, "Approximate bytes held by the message store's memory tier")
+metrics.gauge("yupil_message_store_hot_messages", lambda: len(message_store.hot), "Messages held by the message store's memory tier")
+metrics.gauge("yupil_queue_depth", lambda: {(("queue", "log_sink"),): sum(sink.queue.qsize() for sink in log_sinks.values()),
+                                            (("queue", "translation"),): translation_engine.queue_depth(),
+                                            (("queue", "jobs"),): job_queue.depth(),
+                                            (("queue", "welcome_deletions"),): sum(len(pending) for pending in welcome_deletions.values()),
+                                            (("queue", "attachment_capture"),): len(attachment_store.tasks) if attachment_capture else 0},
+              "Items waiting in background queues")
+metrics.gauge("yupil_translation_cache_lookups", lambda: {(("result", "hit"),): translation_cache.hits,
+                                                         (("result", "miss"),): translation_cache.misses},
+              "Translation cache lookups since start")
+metrics.gauge("yupil_deepl_characters_used", lambda: translation_cache.used(), "DeepL characters used this month")
+
+# Sync commands only when the command tree changed since the last sync
+command_hash_file = "command_sync.json"
 
+def command_tree_hash(guild: discord.abc.Snowflake):
+    """Fingerprints the commands registered for a guild as they would be sent to Discord"""
+    payload = []
+    for command in tree.get_commands(guild = guild):
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:
+            # discord.py before 2.4 takes no tree argument
+            payload.append(command.to_dict())
+    return hashlib.sha256(json.dumps(payload, sort_keys = True, default = str).encode()).hexdigest()
+
+async def sync_commands(guild: discord.abc.Snowflake):
+    """Syncs a guild's commands if their fingerprint differs from the last synced one; delete command_sync.json to force"""
+    synced = {}
+    if os.path.isfile(command_hash_file):
+        with open(command_hash_file) as hash_file:
+            synced = json.load(hash_file)
+    fingerprint = command_tree_hash(guild)
+    if synced.get(str(guild.id)) == fingerprint:
+        print("Commands unchanged since last sync, skipping sync.")
+        return False
+    await tree.sync(guild = guild)
+    synced[str(guild.id)] = fingerprint
+    with open(command_hash_file, "w") as hash_file:
+        json.dump(synced, hash_file)
+    print("Commands synced.")
+    return True
+
+def reload_settings():
+    """Re-reads config.ini for the process and every configured guild"""
+    settings.reload()
+    for guild_id, config in guild_settings.items():
+        config.reload(bot.get_guild(guild_id))
+
+def terminate():
+    global shutdown_task
+    if shutdown_task == None:
+        shutdown_task = asyncio.create_task(close_gracefully("SIGTERM"))
+
+async def close_gracefully(reason: str):
+    await shutdown(reason)
+    await bot.close()
+
+# One-time setup, run once after login and before connecting to the gateway
+metrics_server = None
+shutdown_task = None
+ready_seconds = None  # time from process start to the first on_ready
 
-# Sync commands
 @bot.event
-async def on_ready():
-    await tree.sync(guild = discord.Object(id = server_id))
+async def setup_hook():
+    global metrics_server
+    # Reload config.ini on SIGHUP without a restart
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    # Let background jobs checkpoint on SIGTERM before closing
+    if hasattr(signal, "SIGTERM"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, terminate)
+    # Guild commands sync per guild, one guild at a time to stay within the sync rate limit
+    for guild in guild_objects:
+        await sync_commands(guild = guild)
+    for sink in log_sinks.values():
+        sink.start()
+    if settings.metrics_port != 0:
+        metrics_server = asyncio.create_task(start_metrics_server())
     # Retrieve ticket button message ID
     if os.path.isfile("buttons_message_id.txt"):
         button_message_id = int(open("buttons_message_id.txt", "r").readline())
         bot.add_view(view = Buttons(timeout = None), message_id = button_message_id)
-    print("Logged in and ready to receive commands.")
+    # Rehydrate the close and finish buttons on existing tickets
+    bot.add_view(view = CloseButton(timeout = None))
+    bot.add_view(view = FinishButtons(timeout = None))
 
-# Bot login
+metrics.gauge("yupil_ready_seconds", lambda: ready_seconds or 0, "Seconds from process start to first readiness")
+
+# Runs on every gateway connect; only cheap per-connection work after the first
+@bot.event
+async def on_ready():
+    global ready_seconds
+    for guild_id, config in guild_settings.items():
+        guild = bot.get_guild(guild_id)
+        if guild == None:
+            print(f"Config [{config.label}]: bot is not a member of guild {guild_id}")
+        else:
+            config.resolve(guild)
+    if ready_seconds != None:
+        print("Reconnected.")
+        return
+    ready_seconds = time.monotonic() - startup_started
+    print(f"Logged in to {len(bot.guilds)} guilds on {bot.shard_count} shards and ready to receive commands in {ready_seconds:.1f}s.")
+    # Start the job workers, resuming jobs interrupted by a restart
+    job_queue.start(workers = settings.job_workers)
+    # Resume bulk DMs interrupted by a restart
+    for broadcast in broadcast_store.unfinished():
+        resume_broadcast(broadcast_id = broadcast["id"])
+    # Provision the quarantine role and catch up on channels changed while offline
+    for guild_id, config in guild_settings.items():
+        if config.restrict_mode == "role" and bot.get_guild(guild_id) != None:
+            await get_restricted_role(guild = bot.get_guild(guild_id), reconcile = True)
+
+# Bot login, or run a maintenance task given on the command line
 token = os.getenv('DISCORD_TOKEN')
-bot.run(token)
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill_transcripts":
+        backfill_transcripts(guild_id = int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        bot.run(token)
@@ -0,0 +1,345 @@
+# Local stand-in for the Discord REST API and gateway objects used by YupilBot's handlers
+import asyncio
+import collections
+import datetime
+import random
+import time
+import discord
+
+class FakeDiscord:
+    """Simulated REST backend: per-route rate-limit buckets, a global limit, request latency and call counts"""
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, bucket_size: int = 5, bucket_window: float = 1.0,
+                 global_limit: int = 50, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket_size = bucket_size
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()  # route -> calls
+        self.rate_limited = collections.Counter()  # route -> simulated 429s
+        self.buckets = {}  # (route, major parameter) -> [window start, requests in window]
+        self.global_bucket = [0.0, 0]
+        self.next_id = 10 ** 17
+
+    def snowflake(self):
+        self.next_id += 1
+        return self.next_id
+
+    async def _take(self, bucket: list, size: int, route: str):
+        # On an exhausted bucket, wait for the reset the way discord.py does after a 429
+        while True:
+            now = time.monotonic()
+            if now - bucket[0] >= self.bucket_window:
+                bucket[0], bucket[1] = now, 0
+            if bucket[1] < size:
+                bucket[1] += 1
+                return
+            self.rate_limited[route] += 1
+            await asyncio.sleep(bucket[0] + self.bucket_window - now)
+
+    async def request(self, route: str, major: int = 0):
+        """Simulates one REST call on a route template, bucketed by its major parameter"""
+        await self._take(self.global_bucket, self.global_limit, "global")
+        await self._take(self.buckets.setdefault((route, major), [0.0, 0]), self.bucket_size, route)
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+class FakeAsset:
+    def __init__(self, url: str):
+        self.url = url
+        self.key = url.rsplit("/", 1)[-1]
+
+class FakeRole:
+    def __init__(self, guild, role_id: int, name: str):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeUser:
+    def __init__(self, backend: FakeDiscord, guild, user_id: int, name: str, bot: bool = False, avatar: FakeAsset = None):
+        self.backend = backend
+        self.guild = guild
+        self.id = user_id
+        self.name = name
+        self.global_name = name
+        self.display_name = name
+        self.bot = bot
+        self.avatar = avatar
+        self.display_avatar = avatar or FakeAsset("https://cdn.discordapp.com/embed/avatars/0.png")
+        self.mention = f"<@{user_id}>"
+        self.roles = []
+        self.joined_at = discord.utils.utcnow()
+        self.created_at = discord.utils.snowflake_time(user_id)
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def add_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.backend.request("PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.guild.id)
+            self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.backend.request("DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.guild.id)
+            self.roles.remove(role)
+
+    async def send(self, content: str = None, **kwargs):
+        await self.backend.request("POST /channels/{channel_id}/messages", self.id)
+        return FakeMessage(self.backend, None, self.backend.snowflake(), self.guild.me if self.guild else None, content or "")
+
+class FakeAttachment:
+    def __init__(self, attachment_id: int, filename: str, size: int = 0, content_type: str = None):
+        self.id = attachment_id
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+        self.url = f"https://cdn.discordapp.com/attachments/0/{attachment_id}/{filename}"
+
+class FakeMessage:
+    def __init__(self, backend: FakeDiscord, channel, message_id: int, author: FakeUser, content: str,
+                 attachments: list = None, embeds: list = None):
+        self.backend = backend
+        self.channel = channel
+        self.guild = channel.guild if channel != None else None
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.embeds = embeds or []
+        self.created_at = discord.utils.snowflake_time(message_id)
+        self.jump_url = f"https://discord.com/channels/{self.guild.id if self.guild else '@me'}/{channel.id if channel else 0}/{message_id}"
+
+    async def edit(self, **kwargs):
+        await self.backend.request("PATCH /channels/{channel_id}/messages/{message_id}", self.channel.id)
+
+    async def delete(self):
+        await self.backend.request("DELETE /channels/{channel_id}/messages/{message_id}", self.channel.id)
+
+class FakeResponseError:
+    """The parts of an aiohttp response discord.HTTPException reads"""
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+class AllowAll:
+    view_channel = True
+    read_messages = True
+
+class FakeChannel:
+    """Text, voice, forum or category channel; text history is generated lazily by an optional factory"""
+    def __init__(self, backend: FakeDiscord, guild, channel_id: int, name: str, kind: str = "text", history = None):
+        self.backend = backend
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.kind = kind
+        self.mention = f"<#{channel_id}>"
+        self.jump_url = f"https://discord.com/channels/{guild.id}/{channel_id}"
+        self.overwrites = {}
+        self.history_factory = history  # callable(channel, index) -> FakeMessage
+        self.history_size = 0
+        self.uploaded_bytes = 0
+        self.max_upload_files = None  # uploads with more files are read, then rejected with a 413 like an oversized request
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def permissions_for(self, member):
+        return AllowAll()
+
+    def overwrites_for(self, target):
+        overwrite = self.overwrites.get(target)
+        if overwrite == None:
+            return discord.PermissionOverwrite()
+        allow, deny = overwrite.pair()
+        return discord.PermissionOverwrite.from_pair(allow, deny)
+
+    async def set_permissions(self, target, *, overwrite = None, reason: str = None):
+        if overwrite == None:
+            await self.backend.request("DELETE /channels/{channel_id}/permissions/{overwrite_id}", self.id)
+            self.overwrites.pop(target, None)
+        else:
+            await self.backend.request("PUT /channels/{channel_id}/permissions/{overwrite_id}", self.id)
+            self.overwrites[target] = overwrite
+
+    async def send(self, content: str = None, *, embed = None, embeds = None, file = None, files = None, **kwargs):
+        await self.backend.request("POST /channels/{channel_id}/messages", self.id)
+        uploads = ([file] if file != None else []) + (files or [])
+        if self.max_upload_files != None and len(uploads) > self.max_upload_files:
+            for upload in uploads:
+                upload.fp.read()
+            raise discord.HTTPException(FakeResponseError(413, "Payload Too Large"), "Request entity too large")
+        attachments = []
+        for upload in uploads:
+            data = upload.fp.read()
+            self.uploaded_bytes += len(data)
+            attachments.append(FakeAttachment(self.backend.snowflake(), upload.filename, len(data)))
+            upload.close()
+        embeds = ([embed] if embed != None else []) + (embeds or [])
+        return FakeMessage(self.backend, self, self.backend.snowflake(), self.guild.me, content or "", attachments, embeds)
+
+    async def delete(self, reason: str = None):
+        await self.backend.request("DELETE /channels/{channel_id}", self.id)
+        self.guild.remove_channel(self)
+
+    async def delete_messages(self, messages, reason: str = None):
+        messages = list(messages)
+        if len(messages) == 1:
+            await self.backend.request("DELETE /channels/{channel_id}/messages/{message_id}", self.id)
+        elif len(messages) > 1:
+            await self.backend.request("POST /channels/{channel_id}/messages/bulk-delete", self.id)
+
+    async def fetch_message(self, message_id: int):
+        await self.backend.request("GET /channels/{channel_id}/messages/{message_id}", self.id)
+        return FakeMessage(self.backend, self, message_id, self.guild.me, "")
+
+    async def history(self, limit: int = 100, oldest_first: bool = False):
+        """Yields generated messages, fetching one simulated page of 100 at a time"""
+        count = self.history_size if limit == None else min(limit, self.history_size)
+        for index in range(count):
+            if index % 100 == 0:
+                await self.backend.request("GET /channels/{channel_id}/messages", self.id)
+            yield self.history_factory(self, index if oldest_first else count - index - 1)
+
+class FakeGuild:
+    def __init__(self, backend: FakeDiscord, guild_id: int, name: str = "Benchmark Guild"):
+        self.backend = backend
+        self.id = guild_id
+        self.name = name
+        self.icon = None
+        self.default_role = FakeRole(self, guild_id, "@everyone")
+        self.roles = [self.default_role]
+        self.channels = []
+        self.members_by_id = {}
+        self.me = FakeUser(backend, self, backend.snowflake(), "YupilBot", bot = True,
+                           avatar = FakeAsset("https://cdn.discordapp.com/avatars/0/bot.png"))
+
+    @property
+    def text_channels(self):
+        return [c for c in self.channels if c.kind == "text"]
+
+    @property
+    def voice_channels(self):
+        return [c for c in self.channels if c.kind == "voice"]
+
+    @property
+    def forums(self):
+        return [c for c in self.channels if c.kind == "forum"]
+
+    @property
+    def members(self):
+        return list(self.members_by_id.values())
+
+    def add_channel(self, name: str, kind: str = "text", channel_id: int = None, history = None):
+        channel = FakeChannel(self.backend, self, channel_id or self.backend.snowflake(), name, kind, history)
+        self.channels.append(channel)
+        return channel
+
+    def remove_channel(self, channel: FakeChannel):
+        if channel in self.channels:
+            self.channels.remove(channel)
+
+    def add_role(self, name: str):
+        role = FakeRole(self, self.backend.snowflake(), name)
+        self.roles.append(role)
+        return role
+
+    def add_member(self, name: str):
+        member = FakeUser(self.backend, self, self.backend.snowflake(), name)
+        self.members_by_id[member.id] = member
+        return member
+
+    def get_channel(self, channel_id: int):
+        return next((c for c in self.channels if c.id == channel_id), None)
+
+    def get_channel_or_thread(self, channel_id: int):
+        return self.get_channel(channel_id)
+
+    def get_member(self, user_id: int):
+        return self.members_by_id.get(user_id)
+
+    async def fetch_member(self, user_id: int):
+        await self.backend.request("GET /guilds/{guild_id}/members/{user_id}", self.id)
+        return self.members_by_id[user_id]
+
+    async def create_text_channel(self, name: str, category = None, overwrites: dict = None, **kwargs):
+        await self.backend.request("POST /guilds/{guild_id}/channels", self.id)
+        channel = self.add_channel(name)
+        channel.overwrites = dict(overwrites or {})
+        return channel
+
+    async def create_role(self, name: str, **kwargs):
+        await self.backend.request("POST /guilds/{guild_id}/roles", self.id)
+        return self.add_role(name)
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content: str = None, **kwargs):
+        await self.interaction.backend.request("POST /interactions/{interaction_id}/{interaction_token}/callback", self.interaction.id)
+        self.done = True
+
+    async def defer(self, **kwargs):
+        await self.send_message()
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content: str = None, **kwargs):
+        await self.interaction.backend.request("POST /webhooks/{application_id}/{interaction_token}", self.interaction.id)
+
+class FakeInteraction:
+    """Slash command or modal interaction from a user in a channel"""
+    def __init__(self, backend: FakeDiscord, guild: FakeGuild, user: FakeUser, channel: FakeChannel):
+        self.backend = backend
+        self.id = backend.snowflake()
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.command = None
+        self.created_at = discord.utils.utcnow()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.message = None
+
+    async def edit_original_response(self, **kwargs):
+        await self.backend.request("PATCH /webhooks/{application_id}/{interaction_token}/messages/@original", self.id)
+
+    async def delete_original_response(self):
+        await self.backend.request("DELETE /webhooks/{application_id}/{interaction_token}/messages/@original", self.id)
+
+class FakeRawMessageDelete:
+    """Gateway MESSAGE_DELETE payload"""
+    def __init__(self, message: FakeMessage, cached: bool = True):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.guild_id = message.guild.id
+        self.cached_message = message if cached else None
+
+def utc_from_index(index: int):
+    return datetime.datetime(2024, 1, 1, tzinfo = datetime.timezone.utc) + datetime.timedelta(seconds = index)
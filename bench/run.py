@@ -0,0 +1,290 @@
+# Offline load tests for YupilBot's hot paths against a simulated Discord backend
+#
+#   python bench/run.py                       run every scenario at full size
+#   python bench/run.py --scale 0.1           smaller, faster run
+#   python bench/run.py --output after.json --baseline before.json
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_discord import FakeAttachment, FakeDiscord, FakeGuild, FakeInteraction, FakeMessage, FakeRawMessageDelete, utc_from_index
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+guild_id = 1000
+
+bench_config = """[bench]
+log_channel = 1001
+welcome_channel = 1002
+helpdesk_channel = 1003
+transcript_channel = 1004
+permitted_role = Mods
+restrict_mode = overwrites
+log_flush_interval = 0.5
+metrics_port = 0
+"""
+
+def percentile(samples: list, fraction: float):
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def load_bot(backend: FakeDiscord):
+    """Imports YupilBot in a scratch directory with a generated config, wired to a fake guild"""
+    os.chdir(tempfile.mkdtemp(prefix = "yupil-bench-"))
+    with open("config.ini", "w") as config_file:
+        config_file.write(bench_config)
+    os.environ["YUPIL_ENV"] = "bench"
+    os.environ["DISCORD_SERVER_ID"] = str(guild_id)
+    sys.path.insert(0, repo_dir)
+    import YupilBot
+    return YupilBot
+
+def build_guild(backend: FakeDiscord, channel_count: int):
+    guild = FakeGuild(backend, guild_id)
+    for channel_id, name in ((1001, "logs"), (1002, "welcome"), (1004, "transcripts")):
+        guild.add_channel(name, channel_id = channel_id)
+    guild.add_channel("helpdesk", kind = "category", channel_id = 1003)
+    for i in range(channel_count):
+        guild.add_channel(f"channel-{i}", kind = ("text", "text", "voice", "forum")[i % 4])
+    guild.add_role("Mods")
+    guild.moderator = guild.add_member("moderator")
+    return guild
+
+async def drain_log(yupil):
+    """Waits until every queued log entry has been delivered"""
+    sink = yupil.log_sinks[guild_id]
+    while not sink.queue.empty() or sink.carry != None:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(sink.flush_interval + 0.2)
+
+# Scenarios return (operation count, per-operation latencies in seconds)
+async def restrict_cycle(yupil, backend, guild, scale):
+    """Restricts then unrestricts members on a guild with many channels, timed until their background jobs finish"""
+    samples = []
+    for i in range(max(int(3 * scale), 1)):
+        user = guild.add_member(f"suspect-{i}")
+        started = time.perf_counter()
+        await yupil.restrict.callback(FakeInteraction(backend, guild, guild.moderator, guild.get_channel(1001)), user,
+                                      create_channel = True, send_message = True, custom_message = None)
+        await yupil.job_queue.join()
+        samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await yupil.unrestrict.callback(FakeInteraction(backend, guild, guild.moderator, guild.get_channel(1001)), user,
+                                        delete_ticket = True)
+        await yupil.job_queue.join()
+        samples.append(time.perf_counter() - started)
+    await drain_log(yupil)
+    return len(samples), samples
+
+async def restrict_cycle_role(yupil, backend, guild, scale):
+    """Same as restrict_cycle using the quarantine role mode"""
+    config = yupil.guild_settings[guild_id]
+    config.restrict_mode = "role"
+    try:
+        await yupil.get_restricted_role(guild)
+        return await restrict_cycle(yupil, backend, guild, scale)
+    finally:
+        config.restrict_mode = "overwrites"
+
+async def deletion_storm(yupil, backend, guild, scale):
+    """Logs deletions of cached messages arriving at about 1000 per second"""
+    channel = guild.add_channel("busy-channel")
+    authors = [guild.add_member(f"chatter-{i}") for i in range(50)]
+    messages = []
+    for i in range(int(1000 * scale)):
+        attachments = [FakeAttachment(backend.snowflake(), "photo.png", 2048, "text/plain")] if i % 10 == 0 else []
+        message = FakeMessage(backend, channel, backend.snowflake(), authors[i % len(authors)], f"message number {i} " * 5, attachments)
+        await yupil.on_message(message)
+        messages.append(message)
+    samples = []
+    started = time.perf_counter()
+    for i, message in enumerate(messages):
+        # Pace arrivals at 1000 events per second, as the gateway would deliver them
+        delay = started + i / 1000 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        event_started = time.perf_counter()
+        await yupil.on_raw_message_delete(FakeRawMessageDelete(message))
+        samples.append(time.perf_counter() - event_started)
+    await drain_log(yupil)
+    return len(samples), samples
+
+async def welcome_flood(yupil, backend, guild, scale):
+    """Welcome channel messages from a join wave where every member posts twice"""
+    channel = guild.get_channel(1002)
+    members = [guild.add_member(f"newcomer-{i}") for i in range(int(500 * scale))]
+    samples = []
+    for round_number in range(2):
+        for member in members:
+            message = FakeMessage(backend, channel, backend.snowflake(), member, f"hello from {member.name}")
+            started = time.perf_counter()
+            await yupil.on_message(message)
+            samples.append(time.perf_counter() - started)
+    while channel.id in yupil.welcome_flushes:
+        await asyncio.sleep(0.05)
+    return len(samples), samples
+
+async def ticket_burst(yupil, backend, guild, scale):
+    """Concurrent mod ticket submissions from distinct members"""
+    async def submit(member):
+        modal = yupil.ModModal(title = "Mod Ticket")
+        modal.answer._value = "Someone is sending me scam links in DMs."
+        started = time.perf_counter()
+        await modal.on_submit(FakeInteraction(backend, guild, member, guild.get_channel(1003)))
+        return time.perf_counter() - started
+    members = [guild.add_member(f"reporter-{i}") for i in range(max(int(50 * scale), 1))]
+    samples = await asyncio.gather(*[submit(member) for member in members])
+    return len(samples), list(samples)
+
+async def transcript_export(yupil, backend, guild, scale):
+    """Exports, indexes and uploads the transcript of a long channel"""
+    authors = [guild.add_member(f"talker-{i}") for i in range(20)]
+    def history(channel, index):
+        message = FakeMessage(backend, channel, 10 ** 17 + index, authors[index % len(authors)],
+                              f"Message {index}: the quick brown fox jumps over the lazy dog.")
+        message.created_at = utc_from_index(index)
+        return message
+    channel = guild.add_channel("ticket-long", history = history)
+    channel.history_size = int(50000 * scale)
+    started = time.perf_counter()
+    await yupil.create_transcript(channel = channel)
+    return channel.history_size, [time.perf_counter() - started]
+
+async def join_flood(yupil, backend, guild, scale):
+    """A raid of look-alike accounts joining as fast as the gateway delivers them, quarantined with the role"""
+    config = yupil.guild_settings[guild_id]
+    config.restrict_mode = "role"
+    config.raid_action = "quarantine"
+    try:
+        await yupil.get_restricted_role(guild)
+        samples = []
+        for i in range(int(2000 * scale)):
+            member = guild.add_member(f"free_nitro_{i}")
+            started = time.perf_counter()
+            await yupil.on_member_join(member)
+            samples.append(time.perf_counter() - started)
+        while guild_id in yupil.raid_flushes:
+            await yupil.raid_flushes[guild_id]
+        await drain_log(yupil)
+        return len(samples), samples
+    finally:
+        config.restrict_mode = "overwrites"
+        config.raid_action = "alert"
+
+async def log_split_resend(yupil, backend, guild, scale):
+    """Log entries with attachments whose batch is rejected, resent one at a time; every file must arrive intact"""
+    channel = guild.get_channel(1001)
+    channel.max_upload_files = 1
+    try:
+        sizes = [100 + 100 * (i % 2) for i in range(max(int(20 * scale), 2))]
+        sink = yupil.log_sinks[guild_id]
+        async def send(i, size):
+            started = time.perf_counter()
+            message = await sink.send(content = f"entry {i}", files = [yupil.discord.File(io.BytesIO(b"x" * size), filename = f"entry-{i}.txt")], wait = True)
+            return message, time.perf_counter() - started
+        results = await asyncio.gather(*[send(i, size) for i, size in enumerate(sizes)])
+        for size, (message, elapsed) in zip(sizes, results):
+            delivered = [attachment.size for attachment in message.attachments]
+            if delivered != [size]:
+                raise AssertionError(f"{message.content}: expected a {size}-byte attachment, got {delivered}")
+        return len(results), [elapsed for message, elapsed in results]
+    finally:
+        channel.max_upload_files = None
+
+scenarios = {
+    "restrict_unrestrict": restrict_cycle,
+    "restrict_unrestrict_role": restrict_cycle_role,
+    "deletion_storm": deletion_storm,
+    "welcome_flood": welcome_flood,
+    "ticket_burst": ticket_burst,
+    "transcript_export": transcript_export,
+    "join_flood": join_flood,
+    "log_split_resend": log_split_resend,
+}
+
+async def run_scenario(name: str, yupil, backend: FakeDiscord, guild: FakeGuild, scale: float):
+    backend.calls.clear()
+    backend.rate_limited.clear()
+    tracemalloc.reset_peak()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    operations, samples = await scenarios[name](yupil, backend, guild, scale)
+    elapsed = time.perf_counter() - started
+    return {
+        "operations": operations,
+        "seconds": round(elapsed, 3),
+        "throughput": round(operations / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2) if len(samples) > 0 else 0.0,
+        "rest_calls": sum(backend.calls.values()),
+        "rest_calls_by_route": dict(backend.calls.most_common()),
+        "rate_limited": sum(backend.rate_limited.values()),
+        "peak_memory_mb": round((tracemalloc.get_traced_memory()[1] - baseline_memory) / 1024 / 1024, 2),
+    }
+
+def print_result(name: str, result: dict, baseline: dict = None):
+    compared = ("throughput", "p50_ms", "p99_ms", "rest_calls", "rate_limited", "peak_memory_mb")
+    print(f"\n{name}: {result['operations']} ops in {result['seconds']}s")
+    for key in compared:
+        line = f"  {key:<16}{result[key]:>12}"
+        if baseline != None and key in baseline:
+            before = baseline[key]
+            change = f"{(result[key] - before) / before * 100:+.1f}%" if before else "n/a"
+            line += f"   was {before:>10}  ({change})"
+        print(line)
+    for route, count in list(result["rest_calls_by_route"].items())[:6]:
+        print(f"    {count:>7}  {route}")
+
+async def main(args):
+    backend = FakeDiscord(latency = args.latency, jitter = args.latency / 2, bucket_size = args.bucket_size,
+                          global_limit = args.global_limit, seed = args.seed)
+    yupil = load_bot(backend)
+    guild = build_guild(backend, int(500 * args.scale))
+    yupil.guild_settings[guild_id].resolve(guild)
+    yupil.bot._connection.user = guild.me
+    yupil.bot.get_guild = lambda requested_id: guild if requested_id == guild_id else None
+    yupil.log_sinks[guild_id].start()
+    yupil.job_queue.start(workers = yupil.settings.job_workers)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["scenarios"]
+    tracemalloc.start()
+    results = {}
+    for name in args.scenarios or scenarios:
+        results[name] = await run_scenario(name, yupil, backend, guild, args.scale)
+        print_result(name, results[name], baseline.get(name))
+    tracemalloc.stop()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"scale": args.scale, "latency": args.latency, "scenarios": results}, output_file, indent = 2)
+        print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Runs YupilBot load scenarios against a simulated Discord backend")
+    parser.add_argument("scenarios", nargs = "*", help = f"Scenarios to run (default: all): {', '.join(scenarios)}")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "Multiplier for every scenario's size (default: 1.0)")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Simulated REST round trip in seconds (default: 0.05)")
+    parser.add_argument("--bucket-size", type = int, default = 5, help = "Requests per second per route bucket (default: 5)")
+    parser.add_argument("--global-limit", type = int, default = 50, help = "Requests per second across all routes (default: 50)")
+    parser.add_argument("--seed", type = int, default = 0, help = "Random seed for latency jitter")
+    parser.add_argument("--output", help = "Write results as JSON to this path")
+    parser.add_argument("--baseline", help = "Compare against results previously written with --output")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in scenarios]
+    if len(unknown) > 0:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    # Paths given on the command line are relative to where the harness was started, not its scratch directory
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    asyncio.run(main(args))